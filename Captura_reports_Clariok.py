@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
 import os
+import glob
 import time
 import datetime
 import logging
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -12,8 +18,20 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from git import Repo
 from dotenv import load_dotenv
+from clari_data import EXPORT_SHA256_KEY, content_fingerprint, file_sha256, write_parquet_snapshot
+from snapshot_store import SnapshotStore
+from fiscal_calendar import week_in_quarter
+
+# watchdog é opcional: sem ele, a pasta de downloads é varrida a cada segundo
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +41,16 @@ CLARI_USER      = os.getenv("CLARI_USER")
 REPO_PATH       = os.path.expanduser("~/Documents/Clari")
 DATA_PATH       = os.path.join(REPO_PATH, "Data")
 DOWNLOAD_FOLDER = os.path.expanduser("~/Downloads")
+# Histórico colunar de todas as capturas (ver snapshot_store.py)
+HISTORY_PATH    = os.path.join(DATA_PATH, "history")
+# Aponta para a página mock local (mock_clari_export.py) nos testes offline
+CLARI_BASE_URL  = os.getenv("CLARI_BASE_URL", "https://app.clari.com").rstrip("/")
+# Perfil do Chrome persistente: a sessão do Clari/Okta sobrevive entre execuções
+PROFILE_DIR     = os.path.expanduser(os.getenv("CLARI_PROFILE_DIR", "~/.clari_chrome_profile"))
+# CLARI_HEADLESS=1 roda sem janela (agendado); exige sessão válida no perfil
+HEADLESS        = os.getenv("CLARI_HEADLESS", "0") == "1"
+# O dashboard lê o Parquet; CLARI_KEEP_CSV=1 mantém também o CSV como arquivo
+KEEP_CSV        = os.getenv("CLARI_KEEP_CSV", "0") == "1"
 
 # Garante que a pasta Data exista
 os.makedirs(DATA_PATH, exist_ok=True)
@@ -33,132 +61,384 @@ REPORTS = [
     ("Pipe LATAM FY25 full year",      "LATAM_Year_W{w}.csv"),
 ]
 REPORT_URLS = {
-    "LATAM FY25 This Quarter all pipe": "https://app.clari.com/opportunities/68154b1c2385aa673b611594",
-    "LATAM FY25 NQ all pipe":           "https://app.clari.com/opportunities/681a6248209b07709f9ccc6b",
-    "Pipe LATAM FY25 full year":        "https://app.clari.com/opportunities/681c333553fea2471096c4ba",
+    "LATAM FY25 This Quarter all pipe": f"{CLARI_BASE_URL}/opportunities/68154b1c2385aa673b611594",
+    "LATAM FY25 NQ all pipe":           f"{CLARI_BASE_URL}/opportunities/681a6248209b07709f9ccc6b",
+    "Pipe LATAM FY25 full year":        f"{CLARI_BASE_URL}/opportunities/681c333553fea2471096c4ba",
 }
 
-def week_in_quarter(dt: datetime.date) -> int:
-    fiscal_month = ((dt.month - 12) % 12) + 1
-    fiscal_year  = dt.year if dt.month == 12 else dt.year - 1
-    quarter      = (fiscal_month - 1) // 3
-    start_months = [12, 3, 6, 9]
-    sm = start_months[quarter]
-    sy = fiscal_year if sm == 12 else fiscal_year + 1
-    sd = datetime.date(sy, sm, 1)
-    return ((dt - sd).days // 7) + 1
-
-def download_report(driver, report_name: str, out_path: str):
-    logging.info(f"*** Iniciando download: {report_name}")
-    before = set(os.listdir(DOWNLOAD_FOLDER))
-    wait   = WebDriverWait(driver, 60)
-
-    # Fecha modais abertos
+# Limite para o Clari gerar um export (o painel de notificações é consultado
+# a cada EXPORT_POLL segundos) e para o Chrome terminar o download
+EXPORT_TIMEOUT   = 30 * 60
+EXPORT_POLL      = 3
+DOWNLOAD_TIMEOUT = 180
+# Sem notificação com nome de relatório, o link "cego" dos XPaths fixos só
+# é aceito depois deste tempo (a espera fixa do fluxo antigo), e só para o
+# último export pendente: com outros na fila, o link pode ser de outro relatório
+FALLBACK_AFTER   = 90
+
+# Download direto por HTTP: blocos de 1 MB, timeouts (conexão, leitura)
+CHUNK_SIZE   = 1024 * 1024
+HTTP_TIMEOUT = (10, 300)
+
+class DownloadWatcher(FileSystemEventHandler):
+    """Espera o primeiro .csv novo na pasta de downloads.
+
+    Com watchdog, reage aos eventos do sistema de arquivos (o Chrome grava
+    em .crdownload e renomeia para .csv no fim, então arquivos parciais são
+    ignorados); sem watchdog, varre a pasta a cada segundo.
+    """
+
+    def __init__(self, folder: str):
+        self.folder   = folder
+        self.before   = set()
+        self.found    = None
+        self.ready    = threading.Event()
+        self.observer = None
+
+    def __enter__(self):
+        self.before = set(os.listdir(self.folder))
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(self, self.folder, recursive=False)
+            self.observer.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def _seen(self, path: str):
+        name = os.path.basename(path)
+        if name.lower().endswith('.csv') and name not in self.before and os.path.exists(path):
+            self.found = path
+            self.ready.set()
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._seen(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._seen(event.dest_path)
+
+    def _scan(self):
+        for f in os.listdir(self.folder):
+            self._seen(os.path.join(self.folder, f))
+
+    def wait(self, timeout: float):
+        deadline = time.time() + timeout
+        while not self.ready.is_set() and time.time() < deadline:
+            if self.observer is None:
+                self._scan()
+            self.ready.wait(1)
+        return self.found
+
+# Menu de ações (⋮) da página de relatório: só aparece com sessão válida
+MENU_XPATH = "/html/body/div[1]/div/div/div[1]/div[2]/div/div[1]/div/div[2]/div/div/div[4]/div/div/button"
+# Sino de notificações (links de download dos exports)
+NOTIF_XPATH = "/html/body/div[1]/div/div/div[1]/nav/div[2]/div/button[1]"
+# Trechos de URL que indicam redirecionamento para o login
+LOGIN_MARKERS = ("/login", "okta")
+
+def start_driver(headless: bool = HEADLESS):
+    opts = Options()
+    opts.binary_location = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+    if headless:
+        opts.add_argument("--headless=new") # faz ocultar o clari na tela
+    opts.add_argument("--disable-gpu")
+    opts.add_argument(f"--user-data-dir={PROFILE_DIR}")
+    opts.add_argument("--profile-directory=Default")
+
+    # assume chromedriver is in your PATH (via `brew install --cask chromedriver`)
+    return webdriver.Chrome(options=opts)
+
+def session_is_valid(driver, timeout: float = 30) -> bool:
+    """Abre um relatório e vê se a página carrega ou cai no login."""
+    driver.get(REPORT_URLS[REPORTS[0][0]])
     try:
-        driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ESCAPE)
-        time.sleep(1)
-    except:
-        pass
+        WebDriverWait(driver, timeout).until(
+            lambda d: d.find_elements(By.XPATH, MENU_XPATH)
+            or any(m in d.current_url.lower() for m in LOGIN_MARKERS)
+        )
+    except TimeoutException:
+        return False
+    return bool(driver.find_elements(By.XPATH, MENU_XPATH))
+
+def ensure_login(driver):
+    """Reaproveita a sessão do perfil; só pede login manual se ela expirou."""
+    if session_is_valid(driver):
+        logging.info("Sessão do Clari válida (perfil persistente)")
+        return driver
+    if HEADLESS:
+        driver.quit()
+        raise RuntimeError(
+            "Sessão do Clari expirada: rode uma vez sem CLARI_HEADLESS para fazer login"
+        )
+    driver.get(f"{CLARI_BASE_URL}/login")
+    print("Faça login manualmente (email+Okta) e pressione Enter para continuar…")
+    input()
+    return driver
 
-    # 1) Acessa página do relatório
+def link_href(link) -> str:
+    return link.get_attribute('href') or link.get_attribute('data-url')
+
+def open_notifications(driver):
+    WebDriverWait(driver, 60).until(EC.element_to_be_clickable((By.XPATH, NOTIF_XPATH))).click()
+    time.sleep(1)
+
+def seen_export_links(driver) -> set:
+    """hrefs que já estão no painel de notificações (exports anteriores)."""
+    open_notifications(driver)
+    seen = {link_href(a) for a in driver.find_elements(By.XPATH, "//article//a")}
+    close_panels(driver)
+    return seen
+
+def trigger_export(driver, report_name: str):
+    """Abre o relatório numa aba própria e dispara Export > CSV.
+
+    Retorna o handle da aba e os links de download que já existiam antes do
+    export; collect_export só aceita um link que não esteja entre eles.
+    """
+    logging.info(f"*** Disparando export: {report_name}")
+    wait = WebDriverWait(driver, 60)
+
+    # 1) Nova aba (mesma sessão autenticada) e página do relatório
+    driver.switch_to.new_window('tab')
     driver.get(REPORT_URLS[report_name])
-    time.sleep(5)
 
-    # 2) Abre menu de ações (⋮)
-    menu_xpath = "/html/body/div[1]/div/div/div[1]/div[2]/div/div[1]/div/div[2]/div/div/div[4]/div/div/button"
-    wait.until(EC.element_to_be_clickable((By.XPATH, menu_xpath))).click()
-    time.sleep(2)
+    # 2) Links já existentes: notificações de exports anteriores
+    seen = seen_export_links(driver)
+
+    # 3) Abre menu de ações (⋮) assim que estiver clicável
+    wait.until(EC.element_to_be_clickable((By.XPATH, MENU_XPATH))).click()
 
-    # 3) Seleciona Export > CSV
+    # 4) Seleciona Export > CSV
     export_xpath = "/html/body/div[5]/div/button[5]/div[2]/div"
     wait.until(EC.element_to_be_clickable((By.XPATH, export_xpath))).click()
-    time.sleep(90)
+    return driver.current_window_handle, seen
 
-    # 4) Abre notificações
-    notif_xpath = "/html/body/div[1]/div/div/div[1]/nav/div[2]/div/button[1]"
-    wait.until(EC.element_to_be_clickable((By.XPATH, notif_xpath))).click()
-    time.sleep(2)
+def find_export_link(driver, report_name: str, seen: set, fallback: bool = False, warn: bool = True):
+    # Com vários exports na fila, vale só a notificação mais recente que cita
+    # o relatório: se ela ainda está gerando ou traz um link anterior ao
+    # export, a consulta seguinte tenta de novo
+    articles = driver.find_elements(By.XPATH, "//div[@role='dialog']//article")
+    named = False
+    for article in articles:
+        text = article.text
+        if report_name in text:
+            links = [a for a in article.find_elements(By.XPATH, ".//div[3]/a") if link_href(a) not in seen]
+            return links[0] if links else None
+        named = named or any(name in text for name in REPORT_URLS)
+    # XPaths fixos só quando nenhuma notificação traz nome de relatório
+    if named or not fallback:
+        return None
 
-    # 5) Captura link de download
     if report_name == "Pipe LATAM FY25 full year":
         link_xpath = "/html/body/div[5]/div/div/div[2]/article[1]/div[3]/a"
     else:
         link_xpath = "//div[@role='dialog']//article//div[3]/a"
+    links = [a for a in driver.find_elements(By.XPATH, link_xpath) if link_href(a) not in seen]
+    if not links:
+        if warn:
+            logging.warning(f"Nenhum link novo encontrado com XPath: {link_xpath}")
+        return None
+    return links[0]
 
-    links = driver.find_elements(By.XPATH, link_xpath)
-    if links:
-        href = links[0].get_attribute('href') or links[0].get_attribute('data-url')
-        logging.info(f"Baixando via href: {href}")
-        driver.get(href)
-        time.sleep(1)
-    else:
-        logging.warning(f"Nenhum link encontrado com XPath: {link_xpath}")
+def close_panels(driver):
+    try:
+        driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ESCAPE)
+    except:
+        pass
+
+def wait_export_ready(driver, report_name: str, seen: set, allow_fallback: bool = True,
+                      timeout: float = EXPORT_TIMEOUT):
+    """Consulta o painel de notificações até aparecer um link novo do export.
 
-    # 6) Aguarda o arquivo .csv
+    `allow_fallback=False` (outros exports ainda pendentes) nunca usa os
+    XPaths fixos: só a notificação que cita o relatório vale.
+    """
     start = time.time()
-    latest_file = None
-    while time.time() - start < 180:
-        candidates = [
-            f for f in os.listdir(DOWNLOAD_FOLDER)
-            if f not in before and f.lower().endswith('.csv')
-        ]
-        if candidates:
-            latest_file = max(
-                (os.path.join(DOWNLOAD_FOLDER, f) for f in candidates),
-                key=os.path.getctime
-            )
-            break
-        time.sleep(1)
+    warned = False
+    while True:
+        open_notifications(driver)
+        late = time.time() - start >= FALLBACK_AFTER
+        link = find_export_link(driver, report_name, seen, fallback=late and allow_fallback, warn=False)
+        if link is not None:
+            logging.info(f"Export pronto em {time.time() - start:.1f}s: {report_name}")
+            return link
+        close_panels(driver)
+        if late and not allow_fallback and not warned:
+            logging.warning(f"Nenhuma notificação cita {report_name}; com outros exports pendentes "
+                            "o link pelos XPaths fixos não é usado")
+            warned = True
+        if time.time() - start > timeout:
+            raise RuntimeError(f"Timeout aguardando export de {report_name}")
+        time.sleep(EXPORT_POLL)
+
+def http_session(driver) -> requests.Session:
+    """Sessão HTTP com pool de conexões e os cookies autenticados do Chrome."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=len(REPORTS), pool_maxsize=len(REPORTS),
+        max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent")
+    for c in driver.get_cookies():
+        session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+    return session
+
+def fetch_export(session: requests.Session, href: str, out_path: str) -> str:
+    """Grava o CSV em blocos direto em `out_path` e retorna o sha256.
+
+    Escreve num .part e só renomeia no fim, conferindo o Content-Length
+    contra os bytes recebidos na conexão (antes de descomprimir gzip/deflate).
+    """
+    tmp    = out_path + ".part"
+    digest = hashlib.sha256()
+    try:
+        with session.get(href, stream=True, timeout=HTTP_TIMEOUT) as resp:
+            resp.raise_for_status()
+            expected = resp.headers.get("Content-Length")
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+            # Com Content-Encoding, o Content-Length é o tamanho comprimido
+            received = resp.raw.tell()
+        if expected is not None and int(expected) != received:
+            raise IOError(f"Download incompleto: {received} de {expected} bytes")
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return digest.hexdigest()
+
+def browser_download(driver, href: str, report_name: str, out_path: str):
+    # Caminho antigo: Chrome baixa em ~/Downloads e o arquivo é movido
+    with DownloadWatcher(DOWNLOAD_FOLDER) as watcher:
+        driver.get(href)
+        latest_file = watcher.wait(DOWNLOAD_TIMEOUT)
 
     if not latest_file:
         raise RuntimeError(f"Timeout aguardando CSV para {report_name}")
-
-    # 7) Move e renomeia para Data/
     os.rename(latest_file, out_path)
-    logging.info(f"Relatório salvo em {out_path}")
 
-    # 8) Fecha notificações/modal
-    try:
-        driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ESCAPE)
-    except:
-        pass
+def collect_export(driver, handle: str, seen: set, report_name: str, out_path: str, session=None,
+                   allow_fallback: bool = True) -> str:
+    """Baixa o export assim que ficar pronto, a partir da aba `handle`, para Data/.
+
+    `seen` são os links que já existiam antes do export (ver trigger_export);
+    `allow_fallback` vai para wait_export_ready. Retorna o sha256 do arquivo.
+    """
+    logging.info(f"*** Recolhendo export: {report_name}")
+    driver.switch_to.window(handle)
+
+    # 5–6) Notificações: espera um link novo de download do relatório
+    link = wait_export_ready(driver, report_name, seen, allow_fallback)
+    href = link_href(link)
+    logging.info(f"Baixando via href: {href}")
+
+    # 7) Direto por HTTP com os cookies do navegador; o Chrome fica de reserva
+    if session is not None:
+        try:
+            digest = fetch_export(session, href, out_path)
+            logging.info(f"Relatório salvo em {out_path} (sha256 {digest})")
+        except (requests.RequestException, IOError) as e:
+            logging.warning(f"Download HTTP falhou ({e}); usando o Chrome")
+            session = None
+    if session is None:
+        browser_download(driver, href, report_name, out_path)
+        digest = file_sha256(out_path)
+        logging.info(f"Relatório salvo em {out_path} (sha256 {digest})")
+
+    # 8) Fecha notificações/modal e a aba do relatório
+    close_panels(driver)
+    driver.close()
+    return digest
+
+def latest_snapshot(tpl: str, exclude: str):
+    """Snapshot mais recente em Data/ do mesmo tipo de relatório (ex.: LATAM_CQ_W*)."""
+    prefix = tpl.split("{w}")[0]
+    files = [
+        f for ext in ("csv", "parquet")
+        for f in glob.glob(os.path.join(DATA_PATH, f"{prefix}*.{ext}"))
+        if os.path.abspath(f) != os.path.abspath(exclude)
+    ]
+    return max(files, key=os.path.getmtime) if files else None
+
+def is_duplicate(tpl: str, out_path: str) -> bool:
+    """True se o export tem o mesmo conteúdo do último snapshot do tipo.
+
+    Ignora a ordem das linhas e as colunas voláteis (contadores de dias).
+    """
+    previous = latest_snapshot(tpl, out_path)
+    if previous is None:
+        return False
+    return content_fingerprint(out_path) == content_fingerprint(previous)
 
 def main():
     week = week_in_quarter(datetime.date.today())
     ts   = datetime.datetime.now().strftime("%Y%m%d_%H%M")
 
-    # —> Initialize Chrome using Homebrew-installed chromedriver
-    opts = Options()
-    opts.binary_location = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
-    # opts.add_argument("--headless") # faz ocultar o clari na tela
-    opts.add_argument("--disable-gpu")
-
-    # assume chromedriver is in your PATH (via `brew install --cask chromedriver`)
-    driver = webdriver.Chrome(options=opts)
-
-    driver.get("https://app.clari.com/login")
-    print("Faça login manualmente (email+Okta) e pressione Enter para continuar…")
-    input()
+    # —> Initialize Chrome using Homebrew-installed chromedriver, com o perfil
+    # persistente; o login manual só acontece quando a sessão expirou
+    driver  = ensure_login(start_driver())
+    session = http_session(driver)
 
+    main_handle = driver.current_window_handle
     total_start = time.time()
+
+    # Dispara todos os exports primeiro: o Clari gera os arquivos em paralelo
+    pending = []
     for title, tpl in REPORTS:
         base_name = tpl.format(w=week)
         name, ext  = os.path.splitext(base_name)
         filename   = f"{name}_{ts}{ext}"
-        out_path   = os.path.join(DATA_PATH, filename)
+        handle, seen = trigger_export(driver, title)
+        pending.append((title, tpl, filename, handle, seen, time.time()))
 
-        start = time.time()
-        download_report(driver, title, out_path)
-        elapsed = time.time() - start
-        print(f"⏱️  Relatório '{title}' gerado em {elapsed:.1f}s — salvo como {filename}")
+    # Depois recolhe cada um assim que o Clari avisa que ficou pronto;
+    # export igual ao último snapshot do mesmo tipo é descartado
+    changed = []
+    for i, (title, tpl, filename, handle, seen, triggered) in enumerate(pending):
+        out_path = os.path.join(DATA_PATH, filename)
+        # Link sem nome de relatório só é aceito para o último export pendente
+        last    = i == len(pending) - 1
+        digest  = collect_export(driver, handle, seen, title, out_path, session, allow_fallback=last)
+        elapsed = time.time() - triggered
+        if is_duplicate(tpl, out_path):
+            os.remove(out_path)
+            print(f"⏱️  Relatório '{title}' gerado em {elapsed:.1f}s — sem mudanças, descartado")
+        else:
+            # sha256 do export baixado fica gravado nos metadados do Parquet
+            snapshot = write_parquet_snapshot(out_path, metadata={EXPORT_SHA256_KEY: digest})
+            changed.append(snapshot)
+            part = SnapshotStore(HISTORY_PATH).append(snapshot)
+            if part:
+                changed.append(part)
+            if KEEP_CSV:
+                changed.append(out_path)
+            else:
+                os.remove(out_path)
+            print(f"⏱️  Relatório '{title}' gerado em {elapsed:.1f}s — salvo como {os.path.basename(snapshot)}")
 
+    driver.switch_to.window(main_handle)
     total_elapsed = (time.time() - total_start) / 60
     print(f"✅ Todos finalizados em {total_elapsed:.1f} minutos.")
 
     driver.quit()
 
+    if not changed:
+        print("Nenhum relatório mudou desde a última captura — nada a enviar.")
+        return
+
+    print("Relatórios com mudanças: " + ", ".join(
+        os.path.basename(p) for p in changed if not p.startswith(HISTORY_PATH)))
     repo = Repo(REPO_PATH)
-    repo.git.add(A=True)
+    repo.index.add(changed)
     repo.index.commit(f"Atualiza CSVs FY Week {week}_{ts}")
     repo.remotes.origin.push()
     print("Relatórios enviados ao GitHub com sucesso.")
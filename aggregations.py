@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from fiscal_calendar import fiscal_attributes
+
+MEASURE = 'Total New ASV'
+
+# Todas as quebras que os gráficos do dashboard somam (seções 10 a 14)
+ROLLUP_DIMENSIONS = [
+    'Stage', 'Week', 'Month', 'Sales Team Member', 'Forecast Indicator',
+    'Licensing Program Type', 'Licensing Program', 'Major OLPG1',
+]
+
+# Dimensões derivadas do Close Date pelo calendário fiscal (ano começa em
+# dezembro): início da semana fiscal / do mês fiscal
+DERIVED_DIMENSIONS = {
+    'Week': lambda df: fiscal_attributes(df['Close Date'], ['Fiscal Week Start'])['Fiscal Week Start'],
+    'Month': lambda df: fiscal_attributes(df['Close Date'], ['Fiscal Month Start'])['Fiscal Month Start'],
+}
+
+
+class GroupCodes:
+    """Códigos de grupo de cada dimensão, calculados uma vez por snapshot.
+
+    Todas as dimensões dividem um único espaço de códigos: a dimensão i
+    ocupa [offset_i, offset_i + n_i), e o último código recebe os nulos.
+    Assim todos os rollups saem de um único np.bincount.
+    """
+
+    def __init__(self, df, dims=ROLLUP_DIMENSIONS, measure=MEASURE):
+        self.measure = measure
+        self.weights = np.nan_to_num(df[measure].to_numpy(dtype=float))
+        self.labels = {}
+        self.slices = {}
+        stacked = []
+        offset = 0
+        for dim in dims:
+            if dim in df.columns:
+                series = df[dim]
+            elif dim in DERIVED_DIMENSIONS and 'Close Date' in df.columns:
+                series = DERIVED_DIMENSIONS[dim](df)
+            else:
+                continue
+            codes, uniques = pd.factorize(series, sort=True)
+            if isinstance(uniques, pd.Categorical):
+                uniques = np.asarray(uniques, dtype=object)
+            self.labels[dim] = pd.Index(uniques, name=dim)
+            self.slices[dim] = slice(offset, offset + len(uniques))
+            stacked.append(np.where(codes >= 0, codes + offset, -1))
+            offset += len(uniques)
+        self.n_codes = offset + 1
+        self.codes = np.stack(stacked).astype(np.int32) if stacked else np.empty((0, len(df)), np.int32)
+        self.codes[self.codes < 0] = offset
+
+    @property
+    def dims(self):
+        return list(self.labels)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.weights.nbytes
+
+
+class Rollups:
+    """Somas e contagens de todas as dimensões para um recorte filtrado."""
+
+    def __init__(self, codes, sums, counts):
+        self._codes = codes
+        self._sums = sums
+        self._counts = counts
+
+    def frame(self, dim, order=None):
+        # Só grupos com linhas (como groupby(..., observed=True));
+        # `order` reindexa e deixa NaN nos grupos ausentes
+        sl = self._codes.slices[dim]
+        present = self._counts[sl] > 0
+        out = pd.DataFrame({
+            dim: self._codes.labels[dim][present],
+            self._codes.measure: self._sums[sl][present],
+        })
+        if order is not None:
+            out = out.set_index(dim).reindex(order).reset_index()
+        return out
+
+    def total(self, dim, values):
+        sl = self._codes.slices[dim]
+        mask = self._codes.labels[dim].isin(values)
+        return float(self._sums[sl][mask].sum())
+
+
+def compute_rollups(codes, positions=None):
+    """Todos os rollups do recorte `positions` em uma única passada."""
+    sub = codes.codes if positions is None else codes.codes[:, positions]
+    weights = codes.weights if positions is None else codes.weights[positions]
+    flat = sub.ravel()
+    tiled = np.tile(weights, sub.shape[0])
+    sums = np.bincount(flat, weights=tiled, minlength=codes.n_codes)
+    counts = np.bincount(flat, minlength=codes.n_codes)
+    return Rollups(codes, sums, counts)
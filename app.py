@@ -5,11 +5,22 @@ st.set_page_config(page_title="Dashboard Pipeline LATAM") #, layout="wide"
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 import os
 import io
 import yaml
 import streamlit_authenticator as stauth
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
+from clari_data import load_snapshot, load_detail, load_rows, snapshot_columns, snapshot_sources
+from clari_schema import STAGE_ORDER, DASHBOARD_COLUMNS, DAYS_GROUP_LABELS
+from dataset_store import DatasetStore
+from filter_engine import FilterIndex, FilterChain, ResultCache
+from aggregations import GroupCodes, compute_rollups
+from grid_pages import PAGE_SIZES, order_rows, page_count, page_rows
+from figure_cache import FigureCache
+from committed_store import HISTORY_LIMIT, CommittedDealsStore, with_deal_ids
+from snapshot_store import SnapshotStore, parse_snapshot_name, REPORT, SNAPSHOT
+from snapshot_diff import diff_snapshots, diff_series, summarize, waterfall
 
 # — Carrega o YAML de credenciais —
 with open('credentials.yaml') as f:
@@ -94,42 +105,44 @@ if not os.path.isdir(DIR):
 
 
 
-# 4) Lista de CSVs disponíveis
+# 4) Lista de snapshots disponíveis (Parquet quando existe; o CSV é opcional)
 @st.cache_data
 def list_csv_files():
-    return sorted([f for f in os.listdir(DIR) if f.lower().endswith('.csv')])
-
-# 5) Carrega e sanitiza dados
-def load_data(path):
-    df = pd.read_csv(os.path.join(DIR, path))
-    # 0) Extrai o tipo do CSV (sem extensão) e define o arquivo de commits
-
-
-    df.columns = df.columns.str.strip()
-    df['Opportunity'] = df.get('Opportunity', df.get('Opportunity ID', ''))
-    df['Sales Team Member'] = df.get('Sales Team Member', df.get('Owner', '')).astype(str).str.strip()
-    df['Stage'] = df['Stage'].astype(str).str.strip()
-    df['Close Date'] = pd.to_datetime(df['Close Date'], errors='coerce')
-    df['Total New ASV'] = (
-        df['Total New ASV'].astype(str)
-          .str.replace(r"[\$,]", '', regex=True)
-          .astype(float)
-    )
-    # Converte campos numéricos adicionais para float, para alinhamento correto
-    for col in ['Renewal Bookings','Total DMe Est HASV','Total Attrition','Total TSV','Total Renewal ASV']:
-        if col in df.columns:
-            df[col] = (
-                df[col].astype(str)
-                     .str.replace(r"[\$,]", '', regex=True)
-                     .astype(float)
-            )
-    if 'Sub Territory' in df.columns:
-        df['Region'] = df['Sub Territory'].astype(str).apply(
-            lambda x: 'Hispanic' if 'Hispanic' in x else ('Brazil' if 'Brazil' in x else 'Other')
-        )
-    else:
-        df['Region'] = 'Other'
-    return df
+    return snapshot_sources(DIR)
+
+# 5) Carrega e sanitiza dados (snapshot colunar em cache ao lado do CSV)
+#    Um único frame por snapshot, compartilhado (somente leitura) por todas as sessões
+@st.cache_resource
+def get_dataset_store():
+    return DatasetStore()
+
+def load_shared(source, columns=None):
+    key = DatasetStore.snapshot_key(source, columns)
+    return get_dataset_store().get(key, lambda: load_snapshot(source, columns))
+
+#    `columns` projeta só o que a seção precisa; None = todas as colunas
+def load_data(path, columns=None):
+    return load_shared(os.path.join(DIR, path), columns)
+
+# Cache LRU de recortes filtrados e agregados, por (snapshot, estado dos filtros)
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+# Índice de bitmaps dos filtros, montado uma vez por snapshot
+def load_filter_index(path):
+    key = DatasetStore.snapshot_key(os.path.join(DIR, path), DASHBOARD_COLUMNS) + ('filter_index',)
+    return get_dataset_store().get(key, lambda: FilterIndex(load_data(path, DASHBOARD_COLUMNS)))
+
+# Códigos de grupo de todas as dimensões dos gráficos, uma vez por snapshot
+def load_group_codes(path):
+    key = DatasetStore.snapshot_key(os.path.join(DIR, path), DASHBOARD_COLUMNS) + ('group_codes',)
+    return get_dataset_store().get(key, lambda: GroupCodes(load_data(path, DASHBOARD_COLUMNS)))
+
+# Nomes das colunas do snapshot, uma vez por snapshot
+def load_columns(path):
+    key = DatasetStore.snapshot_key(os.path.join(DIR, path)) + ('columns',)
+    return get_dataset_store().get(key, lambda: snapshot_columns(os.path.join(DIR, path)))
 
 # 6) Seleção de CSV
 st.sidebar.header('📂 Select CSV file')
@@ -138,7 +151,9 @@ if not file:
     st.info('Selecione um CSV para continuar')
     st.stop()
 
-df = load_data(file)
+# Filtros, gráficos e ranking só precisam das colunas do dashboard;
+# textos longos (Next Steps, Forecast Notes) ficam para o Raw Data
+df = load_data(file, DASHBOARD_COLUMNS)
 
 # Deriva o tipo do CSV e define um commit_file específico
 csv_type    = os.path.splitext(file)[0]  
@@ -163,115 +178,119 @@ else:
 
 
 # 7) Filtros básicos
+# Cada filtro só faz AND no bitmap da cadeia; o DataFrame filtrado é
+# materializado uma única vez, depois do filtro EDU. Cada combinação de
+# filtros já vista sai direto do cache (row ids, opções e agregados)
+fidx = load_filter_index(file)
+base_df = df
+chain = FilterChain(
+    fidx, get_result_cache(),
+    DatasetStore.snapshot_key(os.path.join(DIR, file), DASHBOARD_COLUMNS)
+)
 st.sidebar.header('🔍 Filters')
 # Sales Team Member
-tmembers = ['Todos'] + sorted(df['Sales Team Member'].unique())
+tmembers = ['Todos'] + sorted(chain.options('Sales Team Member'))
 sel_member = st.sidebar.selectbox('Sales Team Member', tmembers)
 if sel_member != 'Todos':
-    df = df[df['Sales Team Member'] == sel_member]
+    chain.equals('Sales Team Member', sel_member)
 # Sales Stage (fechadas Clean Up e Lost desmarcadas por padrão, Closed - Booked marcado)
-stages = sorted(df['Stage'].unique())
+stages = sorted(chain.options('Stage'))
 closed = ['Closed - Clean Up', 'Closed - Lost']  # Clean Up e Lost desmarcadas
 # Closed - Booked estará marcado por default
 default_stages = [s for s in stages if s not in closed]
 sel_stages = st.sidebar.multiselect('Sales Stage', stages, default=default_stages)
 if sel_stages:
-    df = df[df['Stage'].isin(sel_stages)]
+    chain.isin('Stage', sel_stages)
 # Region: Brazil / Hispanic
 regions = ['Todos', 'Brazil', 'Hispanic']
 sel_region = st.sidebar.selectbox('Region', regions)
 if sel_region != 'Todos' and 'Sub Territory' in df.columns:
-    df = df[df['Sub Territory'].astype(str).str.contains(sel_region, case=False, na=False)]
+    chain.contains('Sub Territory', sel_region)
 
 
 # 9) Filtros adicionais personalizados
 st.sidebar.header('🔧 Aditional Filters')
 
 # --- 9.1) Fiscal Quarter
-if 'Fiscal Quarter' in df.columns:
+if 'Fiscal Quarter' in fidx:
     sel_fq = st.sidebar.selectbox(
         'Fiscal Quarter',
-        ['Todos'] + sorted(df['Fiscal Quarter'].dropna().unique())
+        ['Todos'] + sorted(chain.options('Fiscal Quarter'))
     )
     if sel_fq != 'Todos':
-        df = df[df['Fiscal Quarter'] == sel_fq]
+        chain.equals('Fiscal Quarter', sel_fq)
 
 # ←── 9.2) Forecast Indicator (cole exatamente este bloco) ──→
-if 'Forecast Indicator' in df.columns:
-    options_fc = sorted(df['Forecast Indicator'].dropna().unique())
+if 'Forecast Indicator' in fidx:
+    options_fc = sorted(chain.options('Forecast Indicator'))
     sel_fc = st.sidebar.multiselect(
         'Forecast Indicator',
         options_fc,
         default=options_fc
     )
     if sel_fc:
-        df = df[df['Forecast Indicator'].isin(sel_fc)]
+        chain.isin('Forecast Indicator', sel_fc)
 # ←─────────────────────────────────────────────────────────→
 
 # --- 9.3) Deal Registration ID
-if 'Deal Registration ID' in df.columns:
+if 'Deal Registration ID' in fidx:
     sel_drid = st.sidebar.selectbox(
         'Deal Registration ID',
-        ['Todos'] + sorted(df['Deal Registration ID'].dropna().unique()),
+        ['Todos'] + sorted(chain.options('Deal Registration ID')),
         key='filter_deal_registration_id'
     )
 
     if sel_drid != 'Todos':
-        df = df[df['Deal Registration ID'] == sel_drid]
+        chain.equals('Deal Registration ID', sel_drid)
 
 # --- 9.4) Dias desde Next Steps
 
-if 'Days Since Next Steps Modified' in df.columns:
-    labels = ['<=7 dias', '8-14 dias', '15-30 dias', '>30 dias']
-    # 1) Garante float e preenche nulos com 0
-    df['Days Since Next Steps Modified'] = pd.to_numeric(
-        df['Days Since Next Steps Modified'], errors='coerce'
-    ).fillna(0)
-    # 2) Agrupa em bins, incluindo o menor valor
-    df['DaysGroup'] = pd.cut(
-        df['Days Since Next Steps Modified'],
-        bins=[0,7,14,30,float('inf')],
-        labels=labels,
-        include_lowest=True
-    )
+# DaysGroup já vem calculado no carregamento (clari_data.sanitize)
+if 'DaysGroup' in fidx:
+    labels = DAYS_GROUP_LABELS
     sel_dg = st.sidebar.selectbox(
         'Days since Next Steps',
         ['Todos'] + labels,
         key='filter_days_since_next_steps'
     )
     if sel_dg != 'Todos':
-        df = df[df['DaysGroup'] == sel_dg]
-
-
-if 'Licensing Program Type' in df.columns:
-    sel_lpt = st.sidebar.selectbox('Licensing Program Type', ['Todos'] + sorted(df['Licensing Program Type'].dropna().unique()))
-    if sel_lpt != 'Todos': df = df[df['Licensing Program Type'] == sel_lpt]
-if 'Opportunity' in df.columns:
-    sel_op = st.sidebar.selectbox('Opportunity', ['Todos'] + sorted(df['Opportunity'].dropna().unique()))
-    if sel_op != 'Todos': df = df[df['Opportunity'] == sel_op]
-if 'Account Name' in df.columns:
-    sel_an = st.sidebar.selectbox('Account Name', ['Todos'] + sorted(df['Account Name'].dropna().unique()))
-    if sel_an != 'Todos': df = df[df['Account Name'] == sel_an]
-if 'Account Address: State/Province' in df.columns:
-    sel_state = st.sidebar.selectbox('Account Address: State/Province', ['Todos'] + sorted(df['Account Address: State/Province'].dropna().unique()))
-    if sel_state != 'Todos': df = df[df['Account Address: State/Province'] == sel_state]
-
-enum_df = df.copy()
+        chain.equals('DaysGroup', sel_dg)
+
+
+if 'Licensing Program Type' in fidx:
+    sel_lpt = st.sidebar.selectbox('Licensing Program Type', ['Todos'] + sorted(chain.options('Licensing Program Type')))
+    if sel_lpt != 'Todos': chain.equals('Licensing Program Type', sel_lpt)
+if 'Opportunity' in fidx:
+    sel_op = st.sidebar.selectbox('Opportunity', ['Todos'] + sorted(chain.options('Opportunity')))
+    if sel_op != 'Todos': chain.equals('Opportunity', sel_op)
+if 'Account Name' in fidx:
+    sel_an = st.sidebar.selectbox('Account Name', ['Todos'] + sorted(chain.options('Account Name')))
+    if sel_an != 'Todos': chain.equals('Account Name', sel_an)
+if 'Account Address: State/Province' in fidx:
+    sel_state = st.sidebar.selectbox('Account Address: State/Province', ['Todos'] + sorted(chain.options('Account Address: State/Province')))
+    if sel_state != 'Todos': chain.equals('Account Address: State/Province', sel_state)
+
 edu_choice = st.sidebar.radio('Filtro EDU', ['All', 'EDU', 'Others'], index=0)
 if edu_choice == 'EDU':
-    df = enum_df[enum_df['Sub Territory'].str.contains('EDU', case=False, na=False)]
+    chain.contains('Sub Territory', 'EDU')
 elif edu_choice == 'Others':
-    df = enum_df[~enum_df['Sub Territory'].str.contains('EDU', case=False, na=False)]
-else:
-    df = enum_df
+    chain.excludes('Sub Territory', 'EDU')
+
+# Materializa o recorte filtrado uma única vez
+df = chain.take(base_df)
+
+# Todos os agregados dos gráficos (fase, semana, mês, vendedor, extras)
+# numa única passada sobre os códigos de grupo do snapshot
+gcodes = load_group_codes(file)
+rollups = chain.memo('rollups', lambda: compute_rollups(gcodes, chain.positions()))
 
 # Totais atualizados após todos os filtros (incluindo EDU)
-total_pipeline = df[df['Stage'].isin([
+total_pipeline = rollups.total('Stage', [
     '03 - Opportunity Qualification','04 - Circle of Influence',
     '05 - Solution Definition and Validation',
     '06 - Customer Commit'
-])]['Total New ASV'].sum()
-total_won = df[df['Stage'].isin(['07 - Execute to Close', 'Closed - Booked'])]['Total New ASV'].sum()
+])
+total_won = rollups.total('Stage', ['07 - Execute to Close', 'Closed - Booked'])
 st.subheader(f"Total Pipeline: {total_pipeline:,.2f}   Total Won: {total_won:,.2f}")
 # Exibir filtros aplicados (excluindo Sales Stage)
 applied_filters = []
@@ -289,288 +308,475 @@ if 'sel_an' in locals() and sel_an != 'Todos': applied_filters.append(f"Account
 if 'sel_state' in locals() and sel_state != 'Todos': applied_filters.append(f"State/Province: {sel_state}")
 # Filtro EDU
 if edu_choice != 'All': applied_filters.append(f"Filtro EDU: {edu_choice}")
+# Downloads sob demanda: o arquivo só é serializado quando alguém clica,
+# e fica no cache de resultados por (snapshot, filtros, nome)
+def on_demand(chain, name, build):
+    return lambda: chain.memo(('download', name), build)
+
 if applied_filters:
     st.markdown("**Applied filters:** " + " | ".join(applied_filters))
-    # Download filtered data (CSV)
-    csv_data = df.to_csv(index=False).encode('utf-8')
+    # Download filtered data (CSV) — todas as colunas do snapshot, não só as do dashboard
     st.download_button(
         '⬇️ Download Filtered Data (CSV)',
-        csv_data,
-        file_name=f'pipeline_{file.replace(".csv","")}.csv',
-        mime='text/csv'
+        on_demand(chain, 'filtered_csv',
+                  lambda df=df: load_detail(os.path.join(DIR, file), df, load_columns(file))
+                  .to_csv(index=False).encode('utf-8')),
+        file_name=f'pipeline_{csv_type}.csv',
+        mime='text/csv',
+        on_click='ignore'
     )
 
 # Helper to download plot as HTML
-def download_html(fig, name):
-    buf = io.StringIO()
-    fig.write_html(buf, include_plotlyjs='cdn')
-    st.download_button(f'⬇️ Download {name} (HTML)', buf.getvalue(), file_name=f'{name}.html', mime='text/html')
-
-# 10) Pipeline por Fase
-st.header('🔍 Pipeline Stage')
-order = [
-    '02 - Prospect', '03 - Opportunity Qualification', '04 - Circle of Influence','05 - Solution Definition and Validation',
-    '06 - Customer Commit', '07 - Execute to Close', 'Closed - Booked'
-]
-
-phase = df[df['Stage'].isin(order)].groupby('Stage')['Total New ASV'].sum().reindex(order).reset_index()
-fig = px.bar(
-    phase, x='Total New ASV', y='Stage', orientation='h', template='plotly_dark',
-    text='Total New ASV', color='Stage', color_discrete_sequence=px.colors.qualitative.Vivid
-)
-fig.update_traces(texttemplate='%{text:,.2f}', textposition='inside')
-st.plotly_chart(fig, use_container_width=True, key='pipeline_stage')
-download_html(fig, 'pipeline_by_stage')
-
-# 11) Pipeline Semanal
-st.header('📈 Weekly Pipeline')
-dfw = df.dropna(subset=['Close Date']).copy()
-dfw['Week'] = dfw['Close Date'].dt.to_period('W').dt.to_timestamp()
-weekly = dfw.groupby('Week')['Total New ASV'].sum().reset_index()
-fig2 = px.line(weekly, x='Week', y='Total New ASV', markers=True, template='plotly_dark', text='Total New ASV')
-fig2.update_traces(texttemplate='%{y:,.2f}', textposition='top center')
-st.plotly_chart(fig2, use_container_width=True, key='pipeline_weekly')
-download_html(fig2, 'pipeline_weekly')
-
-# 12) Pipeline Mensal
-st.header('📆 Monthly Pipeline')
-mon = dfw.copy()
-mon['Month'] = mon['Close Date'].dt.to_period('M').dt.to_timestamp()
-monthly = mon.groupby('Month')['Total New ASV'].sum().reset_index()
-fig3 = px.line(monthly, x='Month', y='Total New ASV', markers=True, template='plotly_dark', text='Total New ASV')
-fig3.update_traces(texttemplate='%{y:,.2f}', textposition='top center')
-st.plotly_chart(fig3, use_container_width=True, key='pipeline_monthly')
-download_html(fig3, 'pipeline_monthly')
-
-# 13) Ranking de Vendedores
-st.header('🏆 Sales Team Ranking')
-r = df.groupby('Sales Team Member')['Total New ASV'].sum().reset_index().sort_values('Total New ASV', ascending=False)
-r['Rank'] = range(1, len(r) + 1)
-r['Total New ASV'] = r['Total New ASV'].map('${:,.2f}'.format)
-st.table(r[['Rank','Sales Team Member','Total New ASV']])
-
-# 14) Gráficos adicionais
-extras = [
-    ('Forecast Indicator','Pipeline by Forecast Indicator'),
-    ('Licensing Program Type','Pipeline by Licensing Program Type'),
-    ('Licensing Program','Pipeline by Licensing Program'),
-    ('Major OLPG1','Pipeline by Product')
-]
-for col, title in extras:
-    if col in df.columns:
-        st.header(f'📊 {title}')
-        dcol = df.groupby(col)['Total New ASV'].sum().reset_index()
+def download_html(fig, name, chain):
+    def build():
+        buf = io.StringIO()
+        fig.write_html(buf, include_plotlyjs='cdn')
+        return buf.getvalue()
+    st.download_button(f'⬇️ Download {name} (HTML)', on_demand(chain, ('html', name), build),
+                       file_name=f'{name}.html', mime='text/html', on_click='ignore')
+
+# Figuras prontas, compartilhadas entre sessões: só são refeitas quando o
+# agregado ou a spec do gráfico mudam
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache()
+
+def time_line(frame, x):
+    fig = px.line(frame, x=x, y='Total New ASV', markers=True, template='plotly_dark', text='Total New ASV')
+    fig.update_traces(texttemplate='%{y:,.2f}', textposition='top center')
+    return fig
+
+def dimension_bar(frame, col):
+    fig = px.bar(
+        frame, x=col, y='Total New ASV', color=col,
+        color_discrete_sequence=px.colors.qualitative.Vivid,
+        template='plotly_dark', text='Total New ASV'
+    )
+    fig.update_traces(texttemplate='%{text:,.2f}', textposition='inside')
+    return fig
+
+# 10–14) Gráficos — fragmento próprio: interações nos committed deals ou no
+# Raw Data não reconstroem os gráficos (e vice-versa)
+@st.fragment
+def render_charts(rollups, gcodes, chain):
+    figures = get_figure_cache()
+    # 10) Pipeline por Fase
+    st.header('🔍 Pipeline Stage')
+    order = STAGE_ORDER[:STAGE_ORDER.index('Closed - Booked') + 1]
+
+    def stage_bar(phase):
         fig = px.bar(
-            dcol, x=col, y='Total New ASV', color=col,
-            color_discrete_sequence=px.colors.qualitative.Vivid,
-            template='plotly_dark', text='Total New ASV'
+            phase, x='Total New ASV', y='Stage', orientation='h', template='plotly_dark',
+            text='Total New ASV', color='Stage', color_discrete_sequence=px.colors.qualitative.Vivid
         )
         fig.update_traces(texttemplate='%{text:,.2f}', textposition='inside')
-        st.plotly_chart(fig, use_container_width=True)
-        download_html(fig, title.replace(' ', '_').lower())
+        return fig
+
+    fig = figures.figure('pipeline_stage', rollups.frame('Stage', order), stage_bar)
+    st.plotly_chart(fig, use_container_width=True, key='pipeline_stage')
+    download_html(fig, 'pipeline_by_stage', chain)
+
+    # 11) Pipeline Semanal
+    st.header('📈 Weekly Pipeline')
+    fig2 = figures.figure('pipeline_weekly', rollups.frame('Week'), lambda weekly: time_line(weekly, 'Week'))
+    st.plotly_chart(fig2, use_container_width=True, key='pipeline_weekly')
+    download_html(fig2, 'pipeline_weekly', chain)
+
+    # 12) Pipeline Mensal
+    st.header('📆 Monthly Pipeline')
+    fig3 = figures.figure('pipeline_monthly', rollups.frame('Month'), lambda monthly: time_line(monthly, 'Month'))
+    st.plotly_chart(fig3, use_container_width=True, key='pipeline_monthly')
+    download_html(fig3, 'pipeline_monthly', chain)
+
+    # 13) Ranking de Vendedores
+    st.header('🏆 Sales Team Ranking')
+    def compute_ranking():
+        r = rollups.frame('Sales Team Member').sort_values('Total New ASV', ascending=False)
+        r['Rank'] = range(1, len(r) + 1)
+        r['Total New ASV'] = r['Total New ASV'].map('${:,.2f}'.format)
+        return r[['Rank','Sales Team Member','Total New ASV']]
+
+    st.table(chain.memo('ranking', compute_ranking))
+
+    # 14) Gráficos adicionais
+    extras = [
+        ('Forecast Indicator','Pipeline by Forecast Indicator'),
+        ('Licensing Program Type','Pipeline by Licensing Program Type'),
+        ('Licensing Program','Pipeline by Licensing Program'),
+        ('Major OLPG1','Pipeline by Product')
+    ]
+    for col, title in extras:
+        if col in gcodes.dims:
+            st.header(f'📊 {title}')
+            fig = figures.figure(('extra', col), rollups.frame(col), lambda dcol, col=col: dimension_bar(dcol, col))
+            st.plotly_chart(fig, use_container_width=True)
+            download_html(fig, title.replace(' ', '_').lower(), chain)
+
+render_charts(rollups, gcodes, chain)
+
+# Contadores dos caches (diagnóstico)
+with st.sidebar.expander('Cache stats', expanded=False):
+    st.json({
+        'figures': get_figure_cache().stats(),
+        'results': get_result_cache().stats(),
+        'store': get_dataset_store().stats(),
+    })
+
+
+# 15) Committed Deals — SQLite compartilhado (WAL): diário de eventos + estado compactado
+@st.cache_resource
+def get_committed_store():
+    return CommittedDealsStore(os.path.join(BASE_DIR, "Data", "committed_deals.sqlite"))
+
+# Committed Deals — fragmento: seleção/edição reroda só esta seção
+@st.fragment
+def render_committed_deals(df, file, csv_type):
+    # 15) Seleção e exibição de Committed Deals
+    st.markdown('---')
+    st.header(f'✅ Upside deals to reach commit — {csv_type}')
+
+    # 01 ── Início isolamento por usuário ──
+    user_dir   = os.path.join(BASE_DIR, "Data", username)
+    os.makedirs(user_dir, exist_ok=True)
+    commit_file = os.path.join(user_dir, f"committed_deals_{csv_type}.csv")
+    store = get_committed_store()
+    # CSV antigo do usuário é importado uma única vez (verificado uma vez por sessão)
+    migrated = st.session_state.setdefault('migrated_csv_types', set())
+    if csv_type not in migrated:
+        store.migrate_csv(username, csv_type, commit_file)
+        migrated.add(csv_type)
+
+    # 02 Inicializa commits salvos em sessão (ainda sem saber as colunas)
+    if 'committed_deals' not in st.session_state:
+        # vazio vira placeholder — as colunas são ajustadas depois
+        st.session_state.committed_deals = store.load(username, csv_type)
+    # ── Fim isolamento por usuário ──
+
+
+
+    # 1) DataFrame base só com os Upside deals ainda abertos
+    commit_disp = df[
+        df['Forecast Indicator'].isin(['Upside', 'Upside - Targeted']) &
+        (~df['Stage'].isin([
+            'Closed - Booked',
+            '07 - Execute to Close',
+            '02 - Prospect'
+        ]))
+    ][[
+        'Deal Registration ID',
+        'Opportunity',
+        'Sales Team Member',
+        'Stage',
+        'Close Date',
+        'Total New ASV'
+    ]]
+    # Next Steps só é lido aqui, e só para as linhas de Upside
+    next_steps = load_rows(os.path.join(DIR, file), ['Next Steps'], commit_disp.index)['Next Steps']
+    commit_disp['Next Steps'] = next_steps.astype(str).str.slice(0,50)
+
+    # Se era DataFrame vazio, preencha agora com as colunas corretas
+    if st.session_state.committed_deals.empty:
+        st.session_state.committed_deals = pd.DataFrame(columns=commit_disp.columns)
 
 
-# 15) Seleção e exibição de Committed Deals
-st.markdown('---')
-st.header(f'✅ Upside deals to reach commit — {csv_type}')
+    # 2) Inicializa commits salvos em sessão (com as colunas de commit_disp)
+    if 'committed_deals' not in st.session_state:
+        st.session_state.committed_deals = store.load(username, csv_type)
+        if st.session_state.committed_deals.empty:
+            st.session_state.committed_deals = pd.DataFrame(columns=commit_disp.columns)
 
-# 01 ── Início isolamento por usuário ──
-user_dir   = os.path.join(BASE_DIR, "Data", username)
-os.makedirs(user_dir, exist_ok=True)
-commit_file = os.path.join(user_dir, f"committed_deals_{csv_type}.csv")
+    # 3) Contador para resetar só o grid de Upside
+    if 'upside_grid_counter' not in st.session_state:
+        st.session_state.upside_grid_counter = 0
 
-# 02 Inicializa commits salvos em sessão (ainda sem saber as colunas)
-if 'committed_deals' not in st.session_state:
-    if os.path.exists(commit_file):
-        st.session_state.committed_deals = pd.read_csv(commit_file)
-    else:
-        # placeholder vazio — vamos ajustar as colunas depois
-        st.session_state.committed_deals = pd.DataFrame()
-# ── Fim isolamento por usuário ──
-
-
-
-# 1) DataFrame base só com os Upside deals ainda abertos
-commit_disp = df[
-    df['Forecast Indicator'].fillna('').isin(['Upside', 'Upside - Targeted']) &
-    (~df['Stage'].isin([
-        'Closed - Booked',
-        '07 - Execute to Close',
-        '02 - Prospect'
-    ]))
-][[
-    'Deal Registration ID',
-    'Opportunity',
-    'Sales Team Member',
-    'Stage',
-    'Close Date',
-    'Total New ASV',
-    'Next Steps'
-]].copy()
-commit_disp['Next Steps'] = commit_disp['Next Steps'].astype(str).str.slice(0,50)
-
-# Se era DataFrame vazio, preencha agora com as colunas corretas
-if st.session_state.committed_deals.empty:
-    st.session_state.committed_deals = pd.DataFrame(columns=commit_disp.columns)
-
-
-# 2) Inicializa commits salvos em sessão (com as colunas de commit_disp)
-if 'committed_deals' not in st.session_state:
-    if os.path.exists(commit_file):
-        st.session_state.committed_deals = pd.read_csv(commit_file)
-    else:
-        st.session_state.committed_deals = pd.DataFrame(columns=commit_disp.columns)
+    # 4) Botão que limpa apenas a seleção de Upside Deals
+    if st.button("✔️ Limpar seleção de Upside Deals"):
+        st.session_state.upside_grid_counter += 1
 
-# 3) Contador para resetar só o grid de Upside
-if 'upside_grid_counter' not in st.session_state:
-    st.session_state.upside_grid_counter = 0
-
-# 4) Botão que limpa apenas a seleção de Upside Deals
-if st.button("✔️ Limpar seleção de Upside Deals"):
-    st.session_state.upside_grid_counter += 1
-
-# 5) Exibe AgGrid para seleção de Upside Deals
-gb = GridOptionsBuilder.from_dataframe(commit_disp)
-gb.configure_default_column(cellStyle={'color':'white','backgroundColor':'#000000'})
-gb.configure_column(
-    'Total New ASV',
-    type=['numericColumn','numberColumnFilter'],
-    cellStyle={'textAlign':'right','color':'white','backgroundColor':'#000000'},
-    cellRenderer=us_format
-)
-gb.configure_selection(selection_mode='multiple', use_checkbox=True)
-
-grid_key = f"upside_deals_grid_{st.session_state.upside_grid_counter}"
-resp = AgGrid(
-    commit_disp,
-    gridOptions=gb.build(),
-    theme='streamlit-dark',
-    update_mode=GridUpdateMode.SELECTION_CHANGED,
-    allow_unsafe_jscode=True,
-    height=300,
-    key=grid_key
-)
+    # 5) Exibe AgGrid para seleção de Upside Deals
+    gb = GridOptionsBuilder.from_dataframe(commit_disp)
+    gb.configure_default_column(cellStyle={'color':'white','backgroundColor':'#000000'})
+    gb.configure_column(
+        'Total New ASV',
+        type=['numericColumn','numberColumnFilter'],
+        cellStyle={'textAlign':'right','color':'white','backgroundColor':'#000000'},
+        cellRenderer=us_format
+    )
+    gb.configure_selection(selection_mode='multiple', use_checkbox=True)
+
+    grid_key = f"upside_deals_grid_{st.session_state.upside_grid_counter}"
+    resp = AgGrid(
+        commit_disp,
+        gridOptions=gb.build(),
+        theme='streamlit-dark',
+        update_mode=GridUpdateMode.SELECTION_CHANGED,
+        allow_unsafe_jscode=True,
+        height=300,
+        key=grid_key
+    )
 
-# 6) Monta commit_df a partir da seleção
-raw = resp.get('selected_rows')
-if isinstance(raw, pd.DataFrame):
-    sel = raw.to_dict('records')
-elif isinstance(raw, list):
-    sel = raw
-else:
-    sel = []
-commit_df = pd.DataFrame(sel, columns=commit_disp.columns)
+    # 6) Monta commit_df a partir da seleção
+    raw = resp.get('selected_rows')
+    if isinstance(raw, pd.DataFrame):
+        sel = raw.to_dict('records')
+    elif isinstance(raw, list):
+        sel = raw
+    else:
+        sel = []
+    commit_df = pd.DataFrame(sel, columns=commit_disp.columns)
+
+    # 7) Edição e merge incremental
+    if not commit_df.empty:
+        st.markdown('---')
+        st.subheader('✏️ Edite os Committed Deals antes de confirmar')
+
+        # Editor nativo para ajustar ou remover linhas
+        edited_df = with_deal_ids(st.data_editor(
+            commit_df,
+            num_rows="dynamic",
+            use_container_width=True
+        ))
+
+        # 7.1) Merge sem perder itens antigos
+        existing = st.session_state.committed_deals
+        combined = pd.concat([existing, edited_df], ignore_index=True)
+        combined = combined.drop_duplicates(
+            subset=['Deal Registration ID'],
+            keep='first'
+        )
+        st.session_state.committed_deals = combined
+
+        # 7.2) Persiste só as linhas novas (as já salvas prevalecem)
+        added = combined[~combined['Deal Registration ID'].isin(existing['Deal Registration ID'])]
+        store.upsert(username, csv_type, added)
 
-# 7) Edição e merge incremental
-if not commit_df.empty:
+    # 8) Editor in-place dos Committed Deals já persistidos
     st.markdown('---')
-    st.subheader('✏️ Edite os Committed Deals antes de confirmar')
+    st.subheader('✏️ Edit Committed Deals')
 
-    # Editor nativo para ajustar ou remover linhas
-    edited_df = st.data_editor(
-        commit_df,
+    edited_commits = st.data_editor(
+        st.session_state.committed_deals,
         num_rows="dynamic",
         use_container_width=True
     )
+    st.caption('Linhas incluídas sem Deal Registration ID são salvas com uma chave manual-….')
+    edited_commits = with_deal_ids(edited_commits)
 
-    # 7.1) Merge sem perder itens antigos
-    existing = st.session_state.committed_deals
-    combined = pd.concat([existing, edited_df], ignore_index=True)
-    combined = combined.drop_duplicates(
-        subset=['Deal Registration ID'],
-        keep='first'
-    )
-    st.session_state.committed_deals = combined
-
-    # 7.2) Persiste no CSV correto
-    combined.to_csv(commit_file, index=False)
-
-# 8) Editor in-place dos Committed Deals já persistidos
-st.markdown('---')
-st.subheader('✏️ Edit Committed Deals')
+    # Se houve alteração, grava só as linhas editadas/removidas
+    if not edited_commits.equals(st.session_state.committed_deals):
+        store.apply_edit(username, csv_type, st.session_state.committed_deals, edited_commits)
+        st.session_state.committed_deals = edited_commits.copy()
 
-edited_commits = st.data_editor(
-    st.session_state.committed_deals,
-    num_rows="dynamic",
-    use_container_width=True
-)
+    # 9) Recalcula o Total New ASV após edição/exclusão
+    total_commits = st.session_state.committed_deals['Total New ASV'].sum()
+    st.header(f"Committed Deals — Total New ASV: {total_commits:,.2f}")
 
-# Se houve alteração, atualiza e regrava
-if not edited_commits.equals(st.session_state.committed_deals):
-    st.session_state.committed_deals = edited_commits.copy()
-    st.session_state.committed_deals.to_csv(commit_file, index=False)
-
-# 9) Recalcula o Total New ASV após edição/exclusão
-total_commits = st.session_state.committed_deals['Total New ASV'].sum()
-st.header(f"Committed Deals — Total New ASV: {total_commits:,.2f}")
-
-# 10) Botão de download da versão editada
-csv_commits = st.session_state.committed_deals.to_csv(index=False).encode('utf-8')
-st.download_button(
-    '⬇️ Download Committed Deals (CSV)',
-    data=csv_commits,
-    file_name=f'committed_deals_{csv_type}.csv',
-    mime='text/csv',
-    key='download_committed_deals'
-)
+    # 10) Botão de download da versão editada (CSV gerado só no clique)
+    commits = st.session_state.committed_deals
+    st.download_button(
+        '⬇️ Download Committed Deals (CSV)',
+        data=lambda: commits.to_csv(index=False).encode('utf-8'),
+        file_name=f'committed_deals_{csv_type}.csv',
+        mime='text/csv',
+        key='download_committed_deals',
+        on_click='ignore'
+    )
 
+    # 11) Desfazer e histórico — cada alteração é um evento no diário
+    def undo_last():
+        if not store.undo(username, csv_type):
+            st.session_state.nothing_to_undo = True
+            return
+        # Limpa a seleção de Upside: senão o deal desfeito volta no 7.2)
+        st.session_state.upside_grid_counter += 1
+        restored = store.load(username, csv_type)
+        st.session_state.committed_deals = (
+            restored if not restored.empty else pd.DataFrame(columns=commit_disp.columns)
+        )
+    st.button('↩️ Desfazer última alteração', key='undo_committed_deals', on_click=undo_last)
+    if st.session_state.pop('nothing_to_undo', False):
+        st.info('Nada para desfazer.')
+    with st.expander('🕘 Histórico de alterações'):
+        # Diário lido só quando pedido, e só os eventos mais recentes
+        if st.toggle('Mostrar histórico', key='show_committed_history'):
+            st.caption(f'Últimas {HISTORY_LIMIT} alterações')
+            st.dataframe(
+                store.history(username, csv_type).drop(columns=['row', 'prev']),
+                use_container_width=True, hide_index=True
+            )
 
-# 16) Dados Brutos e ficha detalhada e ficha detalhada
-st.header('📋 Raw Data')
-disp = df.copy()
-gb = GridOptionsBuilder.from_dataframe(disp)
-gb.configure_default_column(cellStyle={'color':'white','backgroundColor':'#000000'})
-numeric_cols = disp.select_dtypes(include=[np.number]).columns.tolist()
-us_format = JsCode("function(params){return params.value!=null?params.value.toLocaleString('en-US',{minimumFractionDigits:2,maximumFractionDigits:2}):''}")
-for col in numeric_cols:
-    gb.configure_column(
-        col,
-        type=['numericColumn','numberColumnFilter'],
-        cellStyle={'textAlign':'right','color':'white','backgroundColor':'#000000'},
-        cellRenderer=us_format
+render_committed_deals(df, file, csv_type)
+
+
+# 16) Raw Data — fragmento: selecionar uma linha para a ficha reroda só esta seção
+@st.fragment
+def render_raw_data(df, file, chain):
+    # 16) Dados Brutos e ficha detalhada e ficha detalhada
+    st.header('📋 Raw Data')
+    source = os.path.join(DIR, file)
+    raw_columns = load_columns(file)
+
+    # Ordenação, filtro de coluna e paginação rodam no servidor, sobre o
+    # snapshot em cache: só a página visível vai para o navegador
+    c1, c2, c3, c4 = st.columns([3, 1, 3, 3])
+    sort_by = c1.selectbox('Ordenar por', ['—'] + raw_columns, key='raw_sort_by')
+    descending = c2.checkbox('Desc.', key='raw_sort_desc')
+    filter_by = c3.selectbox('Filtrar coluna', ['—'] + raw_columns, key='raw_filter_by')
+    needle = c4.text_input('Contém', key='raw_filter_text')
+
+    def compute_order():
+        return order_rows(
+            df.index,
+            sort_values=load_shared(source, [sort_by])[sort_by] if sort_by != '—' else None,
+            descending=descending,
+            filter_values=load_shared(source, [filter_by])[filter_by] if filter_by != '—' else None,
+            needle=needle.strip()
+        )
+    rows = chain.memo(('raw_order', sort_by, descending, filter_by, needle.strip()), compute_order)
+
+    p1, p2, p3 = st.columns([2, 2, 6])
+    page_size = p1.selectbox('Linhas por página', PAGE_SIZES, index=1, key='raw_page_size')
+    n_pages = page_count(len(rows), page_size)
+    page = p2.number_input('Página', min_value=1, max_value=n_pages, value=1, step=1)
+    p3.caption(f"{len(rows):,} linhas — página {min(page, n_pages)} de {n_pages}")
+
+    # Demais colunas (inclusive textos longos) lidas só para as linhas da página
+    disp = load_detail(source, df.loc[page_rows(rows, min(page, n_pages), page_size)], raw_columns)
+    gb = GridOptionsBuilder.from_dataframe(disp)
+    gb.configure_default_column(
+        cellStyle={'color':'white','backgroundColor':'#000000'},
+        sortable=False, filter=False
     )
-gb.configure_selection(selection_mode='single',use_checkbox=True)
-grid_resp = AgGrid(
-    disp,
-    gridOptions=gb.build(),
-    theme='streamlit-dark',
-    update_mode=GridUpdateMode.SELECTION_CHANGED,
-    allow_unsafe_jscode=True,
-    height=500
-)
-# Download displayed raw data (filtered)
-csv_disp = disp.to_csv(index=False).encode('utf-8')
-st.download_button(
-    '⬇️ Download Displayed Raw Data (CSV)',
-    data=csv_disp,
-    file_name='displayed_raw_data.csv',
-    mime='text/csv'
-)
-sel = grid_resp['selected_rows']
-if isinstance(sel, pd.DataFrame):
-    sel_list = sel.to_dict('records')
-else:
-    sel_list = sel or []
-if sel_list:
-    rec = sel_list[0]
+    numeric_cols = disp.select_dtypes(include=[np.number]).columns.tolist()
+    us_format = JsCode("function(params){return params.value!=null?params.value.toLocaleString('en-US',{minimumFractionDigits:2,maximumFractionDigits:2}):''}")
+    for col in numeric_cols:
+        gb.configure_column(
+            col,
+            type=['numericColumn','numberColumnFilter'],
+            cellStyle={'textAlign':'right','color':'white','backgroundColor':'#000000'},
+            cellRenderer=us_format
+        )
+    gb.configure_selection(selection_mode='single',use_checkbox=True)
+    grid_resp = AgGrid(
+        disp,
+        gridOptions=gb.build(),
+        theme='streamlit-dark',
+        update_mode=GridUpdateMode.SELECTION_CHANGED,
+        allow_unsafe_jscode=True,
+        height=500
+    )
+    # Download displayed raw data (filtered) — todas as linhas, não só a página
+    st.download_button(
+        '⬇️ Download Displayed Raw Data (CSV)',
+        data=on_demand(chain, ('raw_csv', sort_by, descending, filter_by, needle.strip()),
+                       lambda: load_detail(source, df.loc[rows], raw_columns).to_csv(index=False).encode('utf-8')),
+        file_name='displayed_raw_data.csv',
+        mime='text/csv',
+        on_click='ignore'
+    )
+    sel = grid_resp['selected_rows']
+    if isinstance(sel, pd.DataFrame):
+        sel_list = sel.to_dict('records')
+    else:
+        sel_list = sel or []
+    if sel_list:
+        rec = sel_list[0]
+        st.markdown('---')
+        with st.expander(f"🗂 Ficha: {rec.get('Opportunity','')}",expanded=True):
+            highlights=['Stage','Total New ASV','Close Date','Total TSV','Original Close Date','Deal Registration ID','Owner','Total DMe Est HASV','Sales Team Member']
+            # Colunas removidas como duplicadas (ex.: Owner == Sales Team Member) vêm da coluna mantida
+            column_map = disp.attrs.get('column_map', {})
+            cols=st.columns(3)
+            for i,k in enumerate(highlights):
+                with cols[i%3]:
+                    st.markdown(f"<span style='color:#FFD700'><strong>{k}:</strong> {rec.get(k, rec.get(column_map.get(k),''))}</span>",unsafe_allow_html=True)
+            st.markdown('<hr/>',unsafe_allow_html=True)
+            items=[(k,v) for k,v in rec.items() if k not in highlights+['Next Steps','Forecast Notes']]
+            cols2=st.columns(3)
+            for i,(k,v) in enumerate(items):
+                with cols2[i%3]:
+                    st.markdown(f"**{k}:** {v}")
+            st.markdown('<hr/>',unsafe_allow_html=True)
+            st.markdown("<span style='color:#FFD700'><strong>Next Steps:</strong></span>",unsafe_allow_html=True)
+            st.write(rec.get('Next Steps',''))
+            st.markdown('<hr/>',unsafe_allow_html=True)
+            st.markdown("<span style='color:#FFD700'><strong>Forecast Notes:</strong></span>",unsafe_allow_html=True)
+            st.write(rec.get('Forecast Notes',''))
+
+render_raw_data(df, file, chain)
+
+
+# 17) Movimento do pipeline entre duas capturas (histórico em Data/history)
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore(os.path.join(DIR, 'history'))
+
+# O histórico só é sincronizado (e o catálogo relido) quando a lista de
+# snapshots em Data/ ou o mtime de algum deles muda
+def snapshot_listing():
+    return tuple((f, os.stat(os.path.join(DIR, f)).st_mtime_ns) for f in snapshot_sources(DIR))
+
+@st.cache_resource(max_entries=4)
+def history_catalog(listing):
+    store = get_snapshot_store()
+    store.sync(DIR)
+    return store.catalog()
+
+def waterfall_figure(steps):
+    fig = go.Figure(go.Waterfall(
+        x=steps['Step'], y=steps['Total New ASV'],
+        measure=['absolute'] + ['relative'] * (len(steps) - 2) + ['total'],
+        texttemplate='%{y:,.2f}', textposition='outside',
+    ))
+    fig.update_layout(template='plotly_dark', showlegend=False)
+    return fig
+
+@st.fragment
+def render_movement(file):
     st.markdown('---')
-    with st.expander(f"🗂 Ficha: {rec.get('Opportunity','')}",expanded=True):
-        highlights=['Stage','Total New ASV','Close Date','Total TSV','Original Close Date','Deal Registration ID','Owner','Total DMe Est HASV','Sales Team Member']
-        cols=st.columns(3)
-        for i,k in enumerate(highlights):
-            with cols[i%3]:
-                st.markdown(f"<span style='color:#FFD700'><strong>{k}:</strong> {rec.get(k,'')}</span>",unsafe_allow_html=True)
-        st.markdown('<hr/>',unsafe_allow_html=True)
-        items=[(k,v) for k,v in rec.items() if k not in highlights+['Next Steps','Forecast Notes']]
-        cols2=st.columns(3)
-        for i,(k,v) in enumerate(items):
-            with cols2[i%3]:
-                st.markdown(f"**{k}:** {v}")
-        st.markdown('<hr/>',unsafe_allow_html=True)
-        st.markdown("<span style='color:#FFD700'><strong>Next Steps:</strong></span>",unsafe_allow_html=True)
-        st.write(rec.get('Next Steps',''))
-        st.markdown('<hr/>',unsafe_allow_html=True)
-        st.markdown("<span style='color:#FFD700'><strong>Forecast Notes:</strong></span>",unsafe_allow_html=True)
-        st.write(rec.get('Forecast Notes',''))
-
+    st.header('🌊 Pipeline Movement')
+    store = get_snapshot_store()
+    report = parse_snapshot_name(os.path.join(DIR, file))[0]
+    catalog = history_catalog(snapshot_listing())
+    # Em ordem de captura (o catálogo vem ordenado por Captured At)
+    snaps = catalog[catalog[REPORT] == report][SNAPSHOT].astype(str).tolist()
+    if len(snaps) < 2:
+        st.info('Só há uma captura deste relatório — o movimento aparece a partir da segunda.')
+        return
+    st.caption('Pipeline aberto do relatório inteiro (não usa os filtros da sidebar).')
+
+    current = os.path.splitext(file)[0]
+    c1, c2 = st.columns(2)
+    to_snap = c2.selectbox('Até', snaps, index=snaps.index(current) if current in snaps else len(snaps) - 1,
+                           key=f'movement_to_{report}')
+    # "De" só oferece capturas anteriores a "Até"
+    before = snaps[:snaps.index(to_snap)]
+    if not before:
+        st.info('Esta é a primeira captura do relatório — escolha uma captura posterior em "Até".')
+        return
+    from_snap = c1.selectbox('De', before, index=len(before) - 1, key=f'movement_from_{report}')
+
+    # Partes do histórico nunca mudam: o diff de um par é calculado uma vez
+    def compute():
+        rows = store.table(report=report, snapshots=[from_snap, to_snap])
+        old = rows[rows[SNAPSHOT] == from_snap]
+        new = rows[rows[SNAPSHOT] == to_snap]
+        changes = diff_snapshots(old, new)
+        return waterfall(old, new, changes), changes
+    steps, changes = get_result_cache().get_or_compute((store.root, 'movement', from_snap, to_snap), compute)
+
+    fig = get_figure_cache().figure('pipeline_waterfall', steps, waterfall_figure)
+    st.plotly_chart(fig, use_container_width=True, key='pipeline_waterfall')
+
+    st.dataframe(summarize(changes), use_container_width=True)
+    moved = changes.reindex(changes['Delta'].abs().sort_values(ascending=False).index)
+    st.dataframe(moved, use_container_width=True, hide_index=True)
+
+    with st.expander('Semana a semana (pares consecutivos)'):
+        series = get_result_cache().get_or_compute(
+            (store.root, 'movement_series', tuple(snaps)),
+            lambda: diff_series(store.table(report=report))
+        )
+        st.dataframe(series, use_container_width=True, hide_index=True)
 
+render_movement(file)
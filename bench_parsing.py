@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Benchmark do clari_parsing contra a limpeza antiga do app.load_data.
+# Uso: python bench_parsing.py [linhas]   (padrão: 100000)
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from clari_parsing import MONEY_COLUMNS, DATE_COLUMNS, parse_money, parse_dates
+
+
+def synthetic_export(rows, seed=42):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col in MONEY_COLUMNS:
+        values = rng.gamma(2.0, 25_000, rows).round(2)
+        money = pd.Series(values).map('${:,.2f}'.format)
+        # "$86,000" sem centavos, como o Clari exporta valores redondos
+        money = money.str.replace('.00', '', regex=False)
+        money[rng.random(rows) < 0.05] = np.nan
+        data[col] = money
+    start = np.datetime64('2023-12-01')
+    for col in DATE_COLUMNS:
+        days = pd.Series(start + rng.integers(0, 900, rows).astype('timedelta64[D]'))
+        dates = days.dt.strftime('%b ') + days.dt.day.astype(str) + days.dt.strftime(', %Y')
+        dates[rng.random(rows) < 0.05] = np.nan
+        data[col] = dates
+    return pd.DataFrame(data)
+
+
+def legacy_money(series):
+    return series.astype(str).str.replace(r"[\$,]", '', regex=True).astype(float)
+
+
+def legacy_dates(series):
+    return pd.to_datetime(series, errors='coerce')
+
+
+def timed(fn, series, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(series)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = synthetic_export(rows)
+    print(f"{rows:,} linhas sintéticas\n")
+    print(f"{'coluna':<22}{'antigo (linhas/s)':>20}{'novo (linhas/s)':>20}{'ganho':>8}")
+    cases = [(c, legacy_money, parse_money) for c in MONEY_COLUMNS]
+    cases += [(c, legacy_dates, parse_dates) for c in DATE_COLUMNS]
+    for col, old, new in cases:
+        t_old = timed(old, df[col])
+        t_new = timed(new, df[col])
+        print(f"{col:<22}{rows / t_old:>20,.0f}{rows / t_new:>20,.0f}{t_old / t_new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from clari_parsing import parse_columns
+from clari_schema import (
+    DAYS_GROUP_BINS, DAYS_GROUP_LABELS, VOLATILE_COLUMNS, apply_categoricals, normalize_columns,
+)
+
+log = logging.getLogger(__name__)
+
+# Versão do formato do cache — incremente sempre que a sanitização mudar,
+# assim os snapshots antigos em Data/ são descartados automaticamente
+CACHE_VERSION = 6
+CACHE_EXT = '.feather'
+CACHE_META_KEY = b'clari_source'
+# Tabelas já abertas neste processo, por (arquivo, tamanho, mtime): sem o
+# cache em disco (Data/ só leitura, disco cheio) o CSV é lido uma vez só
+TABLE_CACHE_SIZE = 8
+
+# Snapshot comprimido gravado pela captura (vai para o GitHub no lugar do CSV)
+PARQUET_EXT = '.parquet'
+PARQUET_COMPRESSION = 'zstd'
+# Colunas de texto com até esta fração de valores distintos usam dicionário
+DICTIONARY_MAX_RATIO = 0.5
+# Metadado do Parquet com o sha256 do CSV exportado pelo Clari
+EXPORT_SHA256_KEY = 'clari_export_sha256'
+
+
+# 1) Sanitização — mesma regra que antes vivia em app.load_data
+def sanitize(df):
+    # Cabeçalhos repetidos e aliases (Opportunity ID, Owner) tratados uma vez só
+    df = normalize_columns(df)
+    if 'Opportunity' not in df.columns:
+        df['Opportunity'] = ''
+    df['Sales Team Member'] = df.get('Sales Team Member', pd.Series('', index=df.index)).astype(str).str.strip()
+    df['Stage'] = df['Stage'].astype(str).str.strip()
+    # Dinheiro e datas (Close/Original Close/Created) com formatos explícitos
+    df = parse_columns(df)
+    if 'Sub Territory' in df.columns:
+        df['Region'] = df['Sub Territory'].astype(str).apply(
+            lambda x: 'Hispanic' if 'Hispanic' in x else ('Brazil' if 'Brazil' in x else 'Other')
+        )
+    else:
+        df['Region'] = 'Other'
+    # Faixa de dias desde o último Next Steps (antes calculada a cada rerun)
+    if 'Days Since Next Steps Modified' in df.columns:
+        days = pd.to_numeric(df['Days Since Next Steps Modified'], errors='coerce').fillna(0)
+        df['Days Since Next Steps Modified'] = days
+        df['DaysGroup'] = pd.cut(days, bins=DAYS_GROUP_BINS, labels=DAYS_GROUP_LABELS, include_lowest=True)
+    # Colunas de baixa cardinalidade como Categorical (filtros em códigos inteiros)
+    return apply_categoricals(df)
+
+
+def read_raw(path):
+    """Export cru (antes de sanitizar), de um CSV ou de um snapshot Parquet."""
+    if path.lower().endswith(PARQUET_EXT):
+        df = pq.read_table(path).to_pandas()
+        # Parquet devolve None onde o read_csv devolve NaN
+        obj = [c for c in df.columns if df[c].dtype == object]
+        return df.assign(**{c: df[c].where(df[c].notna(), float('nan')) for c in obj}) if obj else df
+    return pd.read_csv(path)
+
+
+def read_clari_csv(path):
+    return sanitize(read_raw(path))
+
+
+def write_parquet_snapshot(source, target=None, metadata=None):
+    """Grava o export cru `source` como Parquet comprimido, ao lado dele.
+
+    Colunas de texto repetitivas (Stage, Owner, Sub Territory...) usam
+    codificação por dicionário; `metadata` ({chave: texto}) vai para o schema
+    do arquivo. Retorna o caminho gravado.
+    """
+    target = target or os.path.splitext(source)[0] + PARQUET_EXT
+    table = _to_arrow(pd.read_csv(source))
+    if metadata:
+        meta = dict(table.schema.metadata or {})
+        meta.update({k.encode(): str(v).encode() for k, v in metadata.items()})
+        table = table.replace_schema_metadata(meta)
+    n_rows = max(table.num_rows, 1)
+    dictionary = [
+        name for name, col in zip(table.column_names, table.columns)
+        if (pa.types.is_string(col.type) or pa.types.is_large_string(col.type))
+        and len(col.unique()) <= n_rows * DICTIONARY_MAX_RATIO
+    ]
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp, compression=PARQUET_COMPRESSION, use_dictionary=dictionary)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return target
+
+
+def snapshot_sources(folder):
+    """Snapshots de `folder`, um por nome: o Parquet quando existe, senão o CSV."""
+    best = {}
+    for f in os.listdir(folder):
+        stem, ext = os.path.splitext(f)
+        if ext.lower() == PARQUET_EXT:
+            best[stem] = f
+        elif ext.lower() == '.csv':
+            best.setdefault(stem, f)
+    return sorted(best.values())
+
+
+# 2) Snapshot colunar ao lado do CSV (Data/<nome>.feather)
+def cache_path(source):
+    return os.path.splitext(source)[0] + CACHE_EXT
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_key(source, sha256=None):
+    st = os.stat(source)
+    return {
+        'version': CACHE_VERSION,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': sha256 or file_sha256(source),
+    }
+
+
+def _read_cache_key(cache):
+    # Lê só o schema do arquivo (sem tocar nas colunas)
+    try:
+        with pa.memory_map(cache) as src:
+            meta = ipc.open_file(src).schema.metadata or {}
+    except (OSError, pa.ArrowException):
+        return None
+    raw = meta.get(CACHE_META_KEY)
+    return json.loads(raw) if raw else None
+
+
+def _write_cache(table, cache, key):
+    meta = dict(table.schema.metadata or {})
+    meta[CACHE_META_KEY] = json.dumps(key).encode()
+    table = table.replace_schema_metadata(meta)
+    # Grava em arquivo temporário e troca de forma atômica: outra sessão
+    # lendo o cache nunca vê um arquivo pela metade
+    tmp = f"{cache}.{os.getpid()}.tmp"
+    try:
+        # Sem compressão, para que a leitura possa usar memory-map direto
+        feather.write_feather(table, tmp, compression='uncompressed')
+        os.replace(tmp, cache)
+    except (OSError, pa.ArrowException) as e:
+        log.warning("Não foi possível gravar o cache %s: %s", cache, e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _read_cache(cache):
+    return feather.read_table(cache, memory_map=True)
+
+
+def _to_arrow(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except pa.ArrowException as e:
+        # Coluna com tipos misturados (ex.: número e texto): grava como texto
+        log.warning("Colunas com tipos misturados convertidas para texto: %s", e)
+        mixed = {
+            c: df[c].where(df[c].isna(), df[c].astype(str))
+            for c in df.columns if df[c].dtype == object
+        }
+        return pa.Table.from_pandas(df.assign(**mixed), preserve_index=False)
+
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def _snapshot_table(source):
+    """Tabela Arrow do snapshot sanitizado (memory-mapped quando o cache é válido).
+
+    Fica em memória no processo enquanto o arquivo de origem não muda.
+    """
+    st = os.stat(source)
+    key = (os.path.abspath(source), st.st_size, st.st_mtime_ns)
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None:
+            _tables.move_to_end(key)
+            return table
+    table = _open_snapshot_table(source)
+    with _tables_lock:
+        _tables[key] = table
+        while len(_tables) > TABLE_CACHE_SIZE:
+            _tables.popitem(last=False)
+    return table
+
+
+def _open_snapshot_table(source):
+    cache = cache_path(source)
+    key = _read_cache_key(cache) if os.path.exists(cache) else None
+
+    if key and key.get('version') == CACHE_VERSION:
+        st = os.stat(source)
+        if key['size'] == st.st_size and key['mtime_ns'] == st.st_mtime_ns:
+            return _read_cache(cache)
+        # mtime mudou (ex.: git checkout) — confirma pelo conteúdo
+        if key['size'] == st.st_size:
+            sha256 = file_sha256(source)
+            if sha256 == key['sha256']:
+                table = _read_cache(cache)
+                _write_cache(table, cache, _source_key(source, sha256))
+                return table
+
+    # Cache ausente ou desatualizado: lê o CSV e regrava o snapshot
+    key = _source_key(source)
+    table = _to_arrow(read_clari_csv(source))
+    _write_cache(table, cache, key)
+    return table
+
+
+def snapshot_columns(source):
+    return _snapshot_table(source).column_names
+
+
+def load_snapshot(source, columns=None):
+    """Carrega o snapshot sanitizado; `columns` projeta só as colunas pedidas.
+
+    Com o cache memory-mapped, colunas não pedidas nunca são lidas do disco.
+    """
+    table = _snapshot_table(source)
+    if columns is not None:
+        table = table.select([c for c in columns if c in table.column_names])
+    return table.to_pandas()
+
+
+def load_rows(source, columns, index):
+    """Só as linhas `index` das colunas pedidas, direto da tabela memory-mapped.
+
+    O índice dos frames carregados por load_snapshot é a posição da linha no
+    snapshot, então as linhas saem por `take` sem converter a coluna inteira.
+    """
+    table = _snapshot_table(source)
+    table = table.select([c for c in columns if c in table.column_names])
+    rows = table.take(pa.array(np.asarray(index, dtype=np.int64))).to_pandas()
+    rows.index = index
+    return rows
+
+
+def load_detail(source, base, columns=None):
+    """Completa `base` (já filtrado) com as demais colunas do snapshot.
+
+    Só as linhas de `base` são materializadas; a ordem das colunas segue o CSV.
+    `columns` são as colunas do snapshot, quando quem chama já as tem.
+    """
+    all_cols = snapshot_columns(source) if columns is None else columns
+    missing = [c for c in all_cols if c not in base.columns]
+    detail = load_rows(source, missing, base.index)
+    order = list(all_cols) + [c for c in base.columns if c not in all_cols]
+    return base.join(detail)[order]
+
+
+# 3) Fingerprint de conteúdo de um export (dedup da captura)
+def content_fingerprint(path, volatile=VOLATILE_COLUMNS):
+    """sha256 do conteúdo do CSV, sem depender da ordem das linhas.
+
+    Lê o export cru (sem sanitizar), em CSV ou Parquet, e ignora as colunas
+    `volatile`; cabeçalho diferente conta como conteúdo diferente.
+    """
+    df = read_raw(path)
+    df = df.drop(columns=[c for c in df.columns if c in volatile])
+    rows = pd.util.hash_pandas_object(df, index=False).sort_values()
+    h = hashlib.sha256()
+    h.update(json.dumps(list(df.columns)).encode())
+    h.update(rows.to_numpy().tobytes())
+    return h.hexdigest()
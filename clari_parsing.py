@@ -0,0 +1,91 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Colunas monetárias e de data conhecidas dos exports do Clari
+MONEY_COLUMNS = [
+    'Total New ASV', 'Renewal Bookings', 'Total DMe Est HASV',
+    'Total Attrition', 'Total TSV', 'Total Renewal ASV'
+]
+DATE_COLUMNS = ['Close Date', 'Original Close Date', 'Created Date']
+
+# Formatos em ordem de prioridade: o export do Clari ("Mar 3, 2025") e o
+# ISO que o pandas grava de volta nos CSVs de committed deals (com "T" ou
+# com espaço entre data e hora)
+DATE_FORMATS = ['%b %d, %Y', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+
+def _as_arrow_strings(series):
+    # NaN/None viram null; só aceita colunas de texto
+    return pa.array(series, type=pa.string(), from_pandas=True)
+
+
+def _to_series(arr, series):
+    return pd.Series(arr.to_numpy(zero_copy_only=False), index=series.index, name=series.name)
+
+
+# 1) Valores monetários: "$86,000" / "$1,708.07" -> float
+def parse_money(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    try:
+        arr = _as_arrow_strings(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Coluna com tipos misturados: cai no caminho antigo (regex do pandas)
+        return pd.to_numeric(
+            series.astype(str).str.replace(r"[\$,]", '', regex=True), errors='coerce'
+        ).astype('float64')
+    cleaned = pc.utf8_trim_whitespace(
+        pc.replace_substring(pc.replace_substring(arr, '$', ''), ',', '')
+    )
+    cleaned = pc.if_else(pc.equal(cleaned, ''), pa.scalar(None, pa.string()), cleaned)
+    try:
+        values = pc.cast(cleaned, pa.float64())
+    except pa.ArrowInvalid:
+        # Algum texto inesperado ("N/A", "-"): converte só o que for número
+        return pd.to_numeric(pd.Series(cleaned.to_pandas(), index=series.index, name=series.name),
+                             errors='coerce').astype('float64')
+    return _to_series(values, series)
+
+
+# 2) Datas: tenta cada formato explícito, sem inferência linha a linha;
+#    só o que nenhum formato reconhece passa pelo pd.to_datetime
+def parse_dates(series, formats=DATE_FORMATS):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    try:
+        arr = _as_arrow_strings(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pd.to_datetime(series, errors='coerce')
+    arr = pc.utf8_trim_whitespace(arr)
+    parsed = None
+    for fmt in formats:
+        step = pc.strptime(arr, format=fmt, unit='s', error_is_null=True)
+        parsed = step if parsed is None else pc.coalesce(parsed, step)
+        if parsed.null_count == arr.null_count:
+            break
+    out = _to_series(parsed, series).astype('datetime64[ns]')
+    leftover = out.isna().to_numpy() & pc.is_valid(arr).to_numpy(zero_copy_only=False)
+    if leftover.any():
+        out[leftover] = [_fallback_date(v) for v in series[leftover]]
+    return out
+
+
+def _fallback_date(value):
+    # Inferência do pandas, valor a valor; fuso horário é descartado
+    ts = pd.to_datetime(value, errors='coerce')
+    return ts.tz_localize(None) if ts is not pd.NaT and ts.tzinfo is not None else ts
+
+
+# 3) Todas as colunas de dinheiro e data de uma vez
+def parse_columns(df, money_columns=MONEY_COLUMNS, date_columns=DATE_COLUMNS):
+    parsed = {}
+    for col in money_columns:
+        if col in df.columns:
+            parsed[col] = parse_money(df[col])
+    for col in date_columns:
+        if col in df.columns:
+            parsed[col] = parse_dates(df[col])
+    if parsed:
+        df = df.assign(**parsed)
+    return df
@@ -0,0 +1,116 @@
+import re
+
+import pandas as pd
+
+# Ordem oficial das fases do funil (usada nos gráficos e no schema)
+STAGE_ORDER = [
+    '02 - Prospect', '03 - Opportunity Qualification', '04 - Circle of Influence',
+    '05 - Solution Definition and Validation', '06 - Customer Commit',
+    '07 - Execute to Close', 'Closed - Booked', 'Closed - Lost', 'Closed - Clean Up'
+]
+
+# Colunas que filtros, KPIs, gráficos e ranking realmente usam
+DASHBOARD_COLUMNS = [
+    'Opportunity', 'Account Name', 'Deal Registration ID', 'Sales Team Member',
+    'Stage', 'Close Date', 'Total New ASV', 'Forecast Indicator',
+    'Days Since Next Steps Modified', 'Sub Territory', 'Region', 'Fiscal Quarter',
+    'Licensing Program Type', 'Licensing Program', 'Major OLPG1',
+    'Account Address: State/Province', 'DaysGroup',
+]
+
+# Faixas de "Days Since Next Steps Modified" usadas no filtro 9.4
+DAYS_GROUP_LABELS = ['<=7 dias', '8-14 dias', '15-30 dias', '>30 dias']
+DAYS_GROUP_BINS = [0, 7, 14, 30, float('inf')]
+
+# Colunas que mudam a cada export mesmo sem mudança nos deals (contadores
+# de dias); ignoradas ao comparar capturas
+VOLATILE_COLUMNS = ['Days Since Next Steps Modified', 'Stage Duration (in days)']
+
+# Colunas alternativas: canônica -> alias usado em alguns exports
+COLUMN_ALIASES = {
+    'Opportunity': 'Opportunity ID',
+    'Sales Team Member': 'Owner',
+}
+
+# Sufixo que o pandas acrescenta a cabeçalhos repetidos ("Account Name.1")
+_DUP_SUFFIX = re.compile(r'^(?P<base>.+)\.(?P<n>\d+)$')
+
+# Colunas de baixa cardinalidade carregadas como Categorical.
+# Lista = ordem estável das categorias; None = ordem alfabética dos valores.
+# Valores fora da lista são acrescentados no fim, nunca descartados.
+CATEGORICAL_COLUMNS = {
+    'Stage': STAGE_ORDER,
+    'Forecast Indicator': ['Forecast', 'Upside - Targeted', 'Upside'],
+    'Region': ['Brazil', 'Hispanic', 'Other'],
+    'Sales Team Member': None,
+    'Sub Territory': None,
+    'Licensing Program Type': None,
+    'Licensing Program': None,
+    'Major OLPG1': None,
+    'Fiscal Quarter': None,
+    'Forecast': None,
+}
+
+
+def _categorize(series, order=None):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    seen = series.dropna().unique().tolist()
+    if order is None:
+        categories = sorted(seen)
+    else:
+        known = set(order)
+        categories = list(order) + sorted(v for v in seen if v not in known)
+    return series.astype(pd.CategoricalDtype(categories))
+
+
+def apply_categoricals(df, schema=CATEGORICAL_COLUMNS):
+    cats = {col: _categorize(df[col], order) for col, order in schema.items() if col in df.columns}
+    return df.assign(**cats) if cats else df
+
+
+def _same_values(a, b):
+    try:
+        return a.equals(b) or a.astype(str).equals(b.astype(str))
+    except (TypeError, ValueError):
+        return False
+
+
+def normalize_columns(df, aliases=COLUMN_ALIASES):
+    """Remove cabeçalhos repetidos e aliases redundantes.
+
+    O mapa coluna removida -> coluna mantida fica em df.attrs['column_map'].
+    """
+    df.columns = df.columns.str.strip()
+    column_map = {}
+
+    # 1) Cabeçalhos repetidos: "X.1" só cai se for cópia idêntica de "X"
+    drop = []
+    for col in df.columns:
+        m = _DUP_SUFFIX.match(col)
+        if m and m.group('base') in df.columns and _same_values(df[m.group('base')], df[col]):
+            drop.append(col)
+            column_map[col] = m.group('base')
+
+    # 2) Aliases: renomeia quando falta a canônica, descarta quando é idêntico
+    rename = {}
+    for canonical, alias in aliases.items():
+        if alias not in df.columns:
+            continue
+        if canonical not in df.columns:
+            rename[alias] = canonical
+            column_map[alias] = canonical
+        elif _same_values(df[canonical], df[alias]):
+            drop.append(alias)
+            column_map[alias] = canonical
+
+    df = df.drop(columns=drop).rename(columns=rename)
+    df.attrs['column_map'] = column_map
+    return df
+
+
+def resolve_column(df, name):
+    """Nome real de `name` no frame, seguindo o mapa de colunas removidas."""
+    if name in df.columns:
+        return name
+    return df.attrs.get('column_map', {}).get(name)
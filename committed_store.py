@@ -0,0 +1,374 @@
+import os
+import json
+import hashlib
+import sqlite3
+import datetime
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+
+DEAL_ID = 'Deal Registration ID'
+# Prefixo da chave gerada para linhas sem Deal Registration ID
+SYNTHETIC_ID_PREFIX = 'manual-'
+
+# Tempo máximo (s) esperando outra sessão liberar a escrita
+BUSY_TIMEOUT = 30
+
+# Eventos pendentes (por usuário e csv_type) que disparam a compactação
+COMPACT_EVERY = 50
+
+# Eventos mostrados no histórico (os mais recentes)
+HISTORY_LIMIT = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS committed_deals (
+    user       TEXT NOT NULL,
+    csv_type   TEXT NOT NULL,
+    deal_id    TEXT NOT NULL,
+    position   INTEGER NOT NULL,
+    row        TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user, csv_type, deal_id)
+);
+CREATE TABLE IF NOT EXISTS committed_events (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    user     TEXT NOT NULL,
+    csv_type TEXT NOT NULL,
+    deal_id  TEXT NOT NULL,
+    op       TEXT NOT NULL,
+    row      TEXT,
+    prev     TEXT,
+    undoes   INTEGER,
+    at       TEXT NOT NULL,
+    position INTEGER
+);
+CREATE INDEX IF NOT EXISTS committed_events_key ON committed_events (user, csv_type, id);
+CREATE TABLE IF NOT EXISTS compacted (
+    user     TEXT NOT NULL,
+    csv_type TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    PRIMARY KEY (user, csv_type)
+);
+CREATE TABLE IF NOT EXISTS migrated_csv (
+    user     TEXT NOT NULL,
+    csv_type TEXT NOT NULL,
+    PRIMARY KEY (user, csv_type)
+);
+"""
+
+
+def _plain(value):
+    # Valores do pandas/numpy em tipos que o json aceita
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _payload(rec):
+    return json.dumps({k: _plain(v) for k, v in rec.items()})
+
+
+def with_deal_ids(frame):
+    """`frame` com uma chave sintética nas linhas sem Deal Registration ID.
+
+    A chave (manual-<hash>) vem do conteúdo da linha, então a mesma linha
+    gera sempre a mesma chave; quem guarda o frame devolvido continua
+    editando a linha pela chave gerada. Linhas totalmente vazias (recém
+    incluídas no editor) ficam como estão.
+    """
+    ids = frame[DEAL_ID] if DEAL_ID in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+    others = frame.drop(columns=[DEAL_ID], errors='ignore')
+    missing = ids.isna() & others.notna().any(axis=1)
+    if not missing.any():
+        return frame
+    ids = ids.astype(object).copy()
+    for i, rec in zip(frame.index[missing.to_numpy()], others[missing].to_dict('records')):
+        ids[i] = SYNTHETIC_ID_PREFIX + hashlib.sha1(_payload(rec).encode()).hexdigest()[:12]
+    return frame.assign(**{DEAL_ID: ids})
+
+
+def _keyed(frame):
+    # {deal id: linha} das linhas com chave; a primeira ocorrência vence
+    out = {}
+    frame = with_deal_ids(frame)
+    if DEAL_ID in frame.columns:
+        for rec in frame.to_dict('records'):
+            if _plain(rec[DEAL_ID]) is not None:
+                out.setdefault(str(rec[DEAL_ID]), rec)
+    return out
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+class CommittedDealsStore:
+    """Committed deals em SQLite (modo WAL), com um diário só de acréscimos.
+
+    Cada inclusão, edição ou remoção é um evento em `committed_events`
+    (nunca alterado nem apagado): gravar é só acrescentar linhas, e o
+    diário serve de auditoria e de base para o desfazer. O estado atual
+    fica materializado em `committed_deals`, uma linha por (usuário,
+    csv_type, deal), e é atualizado pela compactação a cada COMPACT_EVERY
+    eventos; a leitura aplica por cima os eventos ainda não compactados.
+    Linhas sem Deal Registration ID são gravadas com uma chave sintética
+    (ver with_deal_ids).
+    """
+
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        with closing(self._connect()) as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.executescript(_SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        con.execute('PRAGMA synchronous=NORMAL')
+        return con
+
+    @contextmanager
+    def _write(self):
+        # Transação de escrita aberta já com o lock (BEGIN IMMEDIATE): o estado
+        # lido dentro dela é o mesmo sobre o qual os eventos são gravados
+        with closing(self._connect()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                yield con
+            except BaseException:
+                con.rollback()
+                raise
+            con.commit()
+
+    # 1) Estado atual: materializado + eventos pendentes
+    def _watermark(self, con, user, csv_type):
+        row = con.execute(
+            'SELECT event_id FROM compacted WHERE user = ? AND csv_type = ?', (user, csv_type)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _pending(self, con, user, csv_type, after):
+        return con.execute(
+            'SELECT id, deal_id, op, row, position FROM committed_events'
+            ' WHERE user = ? AND csv_type = ? AND id > ? ORDER BY id',
+            (user, csv_type, after),
+        ).fetchall()
+
+    def _replay(self, con, user, csv_type):
+        """{deal id: (posição, linha json)} e os deals tocados por eventos pendentes.
+
+        Deals novos entram no fim; um deal restaurado pelo desfazer de uma
+        remoção volta à posição que tinha.
+        """
+        state = {
+            deal_id: (position, row)
+            for deal_id, position, row in con.execute(
+                'SELECT deal_id, position, row FROM committed_deals WHERE user = ? AND csv_type = ?',
+                (user, csv_type),
+            )
+        }
+        top = max((p for p, _ in state.values()), default=-1)
+        touched = set()
+        for _, deal_id, op, row, position in self._pending(con, user, csv_type, self._watermark(con, user, csv_type)):
+            touched.add(deal_id)
+            if op == 'remove':
+                state.pop(deal_id, None)
+            elif deal_id in state:
+                state[deal_id] = (state[deal_id][0], row)
+            else:
+                if position is None:
+                    top += 1
+                    position = top
+                state[deal_id] = (position, row)
+        return state, touched
+
+    def _state(self, con, user, csv_type):
+        # {deal id: linha (json)} na ordem de exibição
+        state, _ = self._replay(con, user, csv_type)
+        return {d: row for d, (_, row) in sorted(state.items(), key=lambda kv: kv[1][0])}
+
+    def load(self, user, csv_type):
+        with closing(self._connect()) as con:
+            state = self._state(con, user, csv_type)
+        records = [json.loads(r) for r in state.values()]
+        columns = list(dict.fromkeys(c for rec in records for c in rec))
+        return pd.DataFrame(records, columns=columns)
+
+    # 2) Escrita: só acrescenta eventos
+    def _append(self, con, user, csv_type, changes):
+        """Grava eventos (deal_id, linha nova ou None) contra o estado atual.
+
+        Roda dentro da transação de escrita `con`; a remoção guarda a posição
+        do deal para que o desfazer o devolva ao mesmo lugar.
+        """
+        if not changes:
+            return 0
+        now = _now()
+        state, _ = self._replay(con, user, csv_type)
+        events = []
+        for deal_id, row in changes:
+            position, prev = state.get(deal_id, (None, None))
+            if row is None:
+                if prev is None:
+                    continue
+                events.append((user, csv_type, deal_id, 'remove', None, prev, None, now, position))
+                state.pop(deal_id)
+            else:
+                if row == prev:
+                    continue
+                events.append((user, csv_type, deal_id, 'add' if prev is None else 'edit', row, prev, None, now, None))
+                state[deal_id] = (position, row)
+        con.executemany(
+            'INSERT INTO committed_events (user, csv_type, deal_id, op, row, prev, undoes, at, position)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            events,
+        )
+        return len(events)
+
+    def upsert(self, user, csv_type, frame):
+        """Inclui ou edita as linhas de `frame` (chave: Deal Registration ID)."""
+        changes = [(d, _payload(rec)) for d, rec in _keyed(frame).items()]
+        with self._write() as con:
+            count = self._append(con, user, csv_type, changes)
+        self._maybe_compact(user, csv_type)
+        return count
+
+    def delete(self, user, csv_type, deal_ids):
+        with self._write() as con:
+            count = self._append(con, user, csv_type, [(str(d), None) for d in deal_ids])
+        self._maybe_compact(user, csv_type)
+        return count
+
+    def apply_edit(self, user, csv_type, before, after):
+        """Registra só a diferença entre duas versões da tabela editada.
+
+        Linhas removidas viram eventos `remove`; novas ou alteradas, `add`/`edit`.
+        Tudo numa transação só, contra o estado lido dentro dela.
+        """
+        old = _keyed(before)
+        new = _keyed(after)
+        removed = [d for d in old if d not in new]
+        changed = [d for d in new if d not in old or _payload(new[d]) != _payload(old[d])]
+        with self._write() as con:
+            self._append(con, user, csv_type,
+                         [(d, None) for d in removed] + [(d, _payload(new[d])) for d in changed])
+        self._maybe_compact(user, csv_type)
+        return len(changed), len(removed)
+
+    # 3) Desfazer e auditoria
+    def undo(self, user, csv_type):
+        """Desfaz o último evento ainda não desfeito, acrescentando o evento inverso.
+
+        Chamadas seguidas voltam um evento por vez. Retorna o evento desfeito
+        (ou None se não há o que desfazer).
+        """
+        with self._write() as con:
+            last = con.execute(
+                'SELECT id, deal_id, op, prev, position FROM committed_events e'
+                ' WHERE user = ? AND csv_type = ? AND undoes IS NULL'
+                ' AND NOT EXISTS (SELECT 1 FROM committed_events u WHERE u.undoes = e.id)'
+                ' ORDER BY id DESC LIMIT 1',
+                (user, csv_type),
+            ).fetchone()
+            if last is None:
+                return None
+            event_id, deal_id, op, prev, position = last
+            inverse = 'remove' if op == 'add' else ('add' if op == 'remove' else 'edit')
+            state, _ = self._replay(con, user, csv_type)
+            current_position, current = state.get(deal_id, (None, None))
+            con.execute(
+                'INSERT INTO committed_events (user, csv_type, deal_id, op, row, prev, undoes, at, position)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (user, csv_type, deal_id, inverse, prev, current, event_id, _now(),
+                 position if inverse == 'add' else current_position),
+            )
+        self._maybe_compact(user, csv_type)
+        return {'id': event_id, 'deal_id': deal_id, 'op': op}
+
+    def history(self, user, csv_type, limit=HISTORY_LIMIT):
+        """Diário de (usuário, csv_type), do mais recente ao mais antigo.
+
+        Só os `limit` eventos mais recentes (None = diário completo).
+        """
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(
+                'SELECT id, at, op, deal_id AS "Deal Registration ID", undoes, row, prev'
+                ' FROM committed_events WHERE user = ? AND csv_type = ? ORDER BY id DESC LIMIT ?',
+                con, params=(user, csv_type, -1 if limit is None else limit),
+            )
+
+    # 4) Compactação: leva os eventos pendentes para o estado materializado
+    def _maybe_compact(self, user, csv_type):
+        with closing(self._connect()) as con:
+            pending = con.execute(
+                'SELECT COUNT(*) FROM committed_events WHERE user = ? AND csv_type = ? AND id > ?',
+                (user, csv_type, self._watermark(con, user, csv_type)),
+            ).fetchone()[0]
+        if pending >= self.compact_every:
+            self.compact(user, csv_type)
+
+    def compact(self, user, csv_type):
+        """Aplica os eventos pendentes em `committed_deals` numa transação só.
+
+        O diário fica intacto (auditoria e desfazer continuam funcionando).
+        """
+        now = _now()
+        with self._write() as con:
+            events = self._pending(con, user, csv_type, self._watermark(con, user, csv_type))
+            if not events:
+                return 0
+            state, touched = self._replay(con, user, csv_type)
+            for deal_id in touched:
+                if deal_id not in state:
+                    con.execute(
+                        'DELETE FROM committed_deals WHERE user = ? AND csv_type = ? AND deal_id = ?',
+                        (user, csv_type, deal_id),
+                    )
+                    continue
+                position, row = state[deal_id]
+                con.execute(
+                    """
+                    INSERT INTO committed_deals (user, csv_type, deal_id, position, row, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (user, csv_type, deal_id)
+                    DO UPDATE SET position = excluded.position, row = excluded.row,
+                                  updated_at = excluded.updated_at
+                    """,
+                    (user, csv_type, deal_id, position, row, now),
+                )
+            con.execute(
+                'INSERT INTO compacted (user, csv_type, event_id) VALUES (?, ?, ?)'
+                ' ON CONFLICT (user, csv_type) DO UPDATE SET event_id = excluded.event_id',
+                (user, csv_type, events[-1][0]),
+            )
+        return len(events)
+
+    # 5) Migração do CSV antigo (Data/<usuário>/committed_deals_<csv_type>.csv)
+    def migrate_csv(self, user, csv_type, csv_path):
+        """Importa o CSV uma única vez por (usuário, csv_type); o CSV fica intacto.
+
+        A verificação é uma leitura simples: o lock de escrita só é pedido
+        quando há de fato um CSV ainda não importado.
+        """
+        with closing(self._connect()) as con:
+            done = con.execute(
+                'SELECT 1 FROM migrated_csv WHERE user = ? AND csv_type = ?', (user, csv_type)
+            ).fetchone()
+        if done or not os.path.exists(csv_path):
+            return False
+        frame = pd.read_csv(csv_path)
+        with self._write() as con:
+            # Outra sessão pode ter importado entre a leitura e o lock
+            if con.execute(
+                'SELECT 1 FROM migrated_csv WHERE user = ? AND csv_type = ?', (user, csv_type)
+            ).fetchone():
+                return False
+            self._append(con, user, csv_type, [(d, _payload(rec)) for d, rec in _keyed(frame).items()])
+            con.execute('INSERT INTO migrated_csv (user, csv_type) VALUES (?, ?)', (user, csv_type))
+        self._maybe_compact(user, csv_type)
+        return True
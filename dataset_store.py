@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Frames compartilhados entre sessões nunca podem ser alterados in-place:
+# com Copy-on-Write, qualquer escrita numa fatia gera cópia própria.
+# (pandas >= 3 já vem com CoW sempre ligado)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Limite de memória do store (MB), configurável por variável de ambiente
+DEFAULT_MAX_MB = int(os.getenv('CLARI_STORE_MAX_MB', '512'))
+
+
+class _Entry:
+    __slots__ = ('df', 'nbytes')
+
+    def __init__(self, df):
+        self.df = df
+        # DataFrame ou estrutura derivada do snapshot (ex.: FilterIndex)
+        if isinstance(df, pd.DataFrame):
+            self.nbytes = int(df.memory_usage(deep=True).sum())
+        else:
+            self.nbytes = int(getattr(df, 'nbytes', 0))
+
+
+class DatasetStore:
+    """Um DataFrame imutável por snapshot, compartilhado por todas as sessões.
+
+    Acima de `max_mb`, os snapshots (e estruturas derivadas) menos usados
+    recentemente saem primeiro. Cada rerun lê de novo o que a sessão usa,
+    então o que está em uso fica sempre no fim da fila.
+    """
+
+    def __init__(self, max_mb=DEFAULT_MAX_MB):
+        self.max_bytes = max_mb * 1024 * 1024
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def snapshot_key(source, columns=None):
+        # Muda sozinho quando o arquivo de origem é substituído
+        st = os.stat(source)
+        return (source, st.st_size, st.st_mtime_ns, tuple(columns) if columns is not None else None)
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.df
+            # Um lock por chave: sessões simultâneas esperam a mesma leitura
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.df
+            df = loader()
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = _Entry(df)
+                self._loading.pop(key, None)
+                self._evict()
+        return df
+
+    def _evict(self):
+        # A entrada mais recente nunca sai, mesmo acima do limite
+        total = sum(e.nbytes for e in self._entries.values())
+        for key in list(self._entries)[:-1]:
+            if total <= self.max_bytes:
+                return
+            total -= self._entries.pop(key).nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'snapshots': len(self._entries),
+                'mb': sum(e.nbytes for e in self._entries.values()) / 1024 / 1024,
+                'max_mb': self.max_bytes / 1024 / 1024,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,31 @@
+import hashlib
+import json
+
+import pandas as pd
+
+from filter_engine import ResultCache
+
+# Quantas figuras prontas o cache guarda (cada uma é pequena: só os agregados)
+FIGURE_CACHE_SIZE = 256
+
+
+def fingerprint(frame):
+    """Hash do conteúdo de um agregado (valores, índice e nomes de coluna)."""
+    h = hashlib.sha1()
+    h.update(json.dumps([str(c) for c in frame.columns]).encode())
+    h.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class FigureCache(ResultCache):
+    """Figuras Plotly prontas, por (spec do gráfico, fingerprint do agregado).
+
+    Se o agregado não mudou (ex.: rerun por edição nos committed deals), a
+    figura já montada é reaproveitada. As figuras são somente leitura.
+    """
+
+    def __init__(self, max_entries=FIGURE_CACHE_SIZE):
+        super().__init__(max_entries)
+
+    def figure(self, spec, frame, build):
+        return self.get_or_compute((spec, fingerprint(frame)), lambda: build(frame))
@@ -0,0 +1,271 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Colunas com filtro de igualdade/lista na sidebar (seções 7 e 9 do app)
+FILTER_COLUMNS = [
+    'Sales Team Member', 'Stage', 'Fiscal Quarter', 'Forecast Indicator',
+    'Deal Registration ID', 'DaysGroup', 'Licensing Program Type',
+    'Opportunity', 'Account Name', 'Account Address: State/Province',
+]
+
+# Filtros "contém" (sem diferenciar maiúsculas): Region e EDU sobre Sub Territory
+CONTAINS_FILTERS = {
+    'Sub Territory': ['Brazil', 'Hispanic', 'EDU'],
+}
+
+# Até quantos valores distintos a coluna guarda um bitmap por valor;
+# acima disso (Opportunity, Account Name...) guarda só os row ids de cada valor
+DENSE_MAX_VALUES = 64
+
+# Quantos resultados (bitmaps, row ids, agregados) o cache LRU guarda
+RESULT_CACHE_SIZE = int(os.getenv('CLARI_RESULT_CACHE_SIZE', '512'))
+# Limite de memória (MB) do cache de resultados: downloads e ordenações do
+# Raw Data também ficam nele, então o número de entradas não basta
+RESULT_CACHE_MAX_MB = int(os.getenv('CLARI_RESULT_CACHE_MAX_MB', '128'))
+
+
+def _nbytes(value):
+    # Tamanho aproximado de um resultado guardado no cache
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value)
+    return int(getattr(value, 'nbytes', 0)) or sys.getsizeof(value)
+
+
+class _Column:
+    __slots__ = ('codes', 'values', 'lookup', 'bitmaps', 'order', 'offsets')
+
+    def __init__(self, series, n_rows):
+        codes, uniques = pd.factorize(series, sort=True)
+        self.codes = codes.astype(np.int32)
+        self.values = np.asarray(uniques, dtype=object)
+        self.lookup = pd.Index(self.values)
+        self.bitmaps = None
+        self.order = None
+        self.offsets = None
+        valid = np.flatnonzero(self.codes >= 0)
+        if len(self.values) <= DENSE_MAX_VALUES:
+            dense = np.zeros((len(self.values), n_rows), dtype=bool)
+            dense[self.codes[valid], valid] = True
+            self.bitmaps = np.packbits(dense, axis=1)
+        else:
+            # Row ids agrupados por valor: order[offsets[c]:offsets[c+1]]
+            self.order = valid[np.argsort(self.codes[valid], kind='stable')]
+            counts = np.bincount(self.codes[valid], minlength=len(self.values))
+            self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    @property
+    def nbytes(self):
+        total = self.codes.nbytes
+        for arr in (self.bitmaps, self.order, self.offsets):
+            if arr is not None:
+                total += arr.nbytes
+        return total
+
+
+class FilterIndex:
+    """Bitmaps de filtro de um snapshot, montados uma vez no carregamento.
+
+    Os filtros ativos se combinam com AND bit a bit sobre bitmaps
+    empacotados (1 bit por linha); o DataFrame filtrado só é materializado
+    no fim, com `take(frame, bits)`.
+    """
+
+    def __init__(self, df, columns=FILTER_COLUMNS, contains=CONTAINS_FILTERS):
+        self.n_rows = len(df)
+        self._columns = {c: _Column(df[c], self.n_rows) for c in columns if c in df.columns}
+        self._contains = {}
+        for col, needles in contains.items():
+            if col not in df.columns:
+                continue
+            for needle in needles:
+                mask = df[col].str.contains(needle, case=False, na=False).to_numpy(dtype=bool)
+                self._contains[(col, needle)] = np.packbits(mask)
+        self._all = np.packbits(np.ones(self.n_rows, dtype=bool))
+
+    @property
+    def nbytes(self):
+        return (sum(c.nbytes for c in self._columns.values())
+                + sum(b.nbytes for b in self._contains.values()) + self._all.nbytes)
+
+    def __contains__(self, col):
+        return col in self._columns
+
+    def all(self):
+        return self._all.copy()
+
+    def none(self):
+        return np.zeros_like(self._all)
+
+    def _from_rows(self, rows):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    # 1) Bitmap das linhas em que `col` está em `values`
+    def isin(self, col, values):
+        c = self._columns[col]
+        codes = c.lookup.get_indexer(list(values))
+        codes = codes[codes >= 0]
+        if len(codes) == 0:
+            return self.none()
+        if c.bitmaps is not None:
+            return np.bitwise_or.reduce(c.bitmaps[codes], axis=0)
+        rows = np.concatenate([c.order[c.offsets[i]:c.offsets[i + 1]] for i in codes])
+        return self._from_rows(rows)
+
+    def equals(self, col, value):
+        return self.isin(col, [value])
+
+    # 2) Bitmap de "col contém needle" (pré-calculado)
+    def contains(self, col, needle):
+        return self._contains[(col, needle)].copy()
+
+    def invert(self, bits):
+        return np.bitwise_and(np.bitwise_not(bits), self._all)
+
+    # 3) Valores de `col` presentes nas linhas selecionadas (opções em cascata)
+    def options(self, col, bits):
+        c = self._columns[col]
+        if c.bitmaps is not None:
+            present = np.bitwise_and(c.bitmaps, bits).any(axis=1)
+            return c.values[present].tolist()
+        codes = c.codes[self.positions(bits)]
+        return c.values[np.unique(codes[codes >= 0])].tolist()
+
+    # 4) Materialização
+    def positions(self, bits):
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+    def count(self, bits):
+        return int(np.unpackbits(bits, count=self.n_rows).sum())
+
+    def take(self, frame, bits):
+        return frame.iloc[self.positions(bits)]
+
+
+@dataclass(frozen=True)
+class FilterState:
+    """Seleções da sidebar em forma canônica e hashável.
+
+    Cada passo é (operação, coluna, valores); valores de multiselect são
+    ordenados, então a mesma combinação sempre gera a mesma chave.
+    """
+    steps: tuple = ()
+
+    def then(self, op, col, values=()):
+        return FilterState(self.steps + ((op, col, tuple(sorted(map(str, values)))),))
+
+
+class ResultCache:
+    """LRU de resultados derivados de (snapshot, FilterState), compartilhado entre sessões.
+
+    Limitado por número de entradas e por `max_mb`; um resultado maior que o
+    limite inteiro é devolvido sem ser guardado. Os valores guardados são
+    somente leitura para quem os recebe.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, max_mb=RESULT_CACHE_MAX_MB):
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        value = compute()
+        size = _nbytes(value)
+        with self._lock:
+            self.misses += 1
+            if size > self.max_bytes:
+                return value
+            if key in self._items:
+                self._bytes -= self._sizes[key]
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                old, _ = self._items.popitem(last=False)
+                self._bytes -= self._sizes.pop(old)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'mb': self._bytes / 1024 / 1024,
+                'max_mb': self.max_bytes / 1024 / 1024,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class FilterChain:
+    """Aplica os filtros da sidebar em sequência, memorizando cada prefixo.
+
+    Voltar a uma combinação já vista (por qualquer sessão) só consulta o cache.
+    """
+
+    def __init__(self, index, cache, snapshot):
+        self.index = index
+        self.cache = cache
+        self.snapshot = snapshot
+        self.state = FilterState()
+        self.bits = index.all()
+
+    def _memo(self, name, compute):
+        return self.cache.get_or_compute((self.snapshot, self.state, name), compute)
+
+    def _step(self, op, col, values, make_bits):
+        parent = self.bits
+        self.state = self.state.then(op, col, values)
+        self.bits = self._memo('bits', lambda: np.bitwise_and(parent, make_bits()))
+
+    def options(self, col):
+        return self._memo(('options', col), lambda: self.index.options(col, self.bits))
+
+    def isin(self, col, values):
+        self._step('isin', col, values, lambda: self.index.isin(col, values))
+
+    def equals(self, col, value):
+        self.isin(col, [value])
+
+    def contains(self, col, needle):
+        self._step('contains', col, [needle], lambda: self.index.contains(col, needle))
+
+    def excludes(self, col, needle):
+        self._step('excludes', col, [needle],
+                   lambda: self.index.invert(self.index.contains(col, needle)))
+
+    def positions(self):
+        return self._memo('rows', lambda: self.index.positions(self.bits))
+
+    def take(self, frame):
+        return frame.iloc[self.positions()]
+
+    def memo(self, name, compute):
+        """Agregados do recorte atual (totais, séries, ranking) no mesmo cache."""
+        return self._memo(('agg', name), compute)
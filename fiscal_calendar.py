@@ -0,0 +1,61 @@
+import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Ano fiscal começa em dezembro: FY25 = dez/2024 a nov/2025
+FISCAL_YEAR_START_MONTH = 12
+
+# Faixa coberta pela tabela; datas fora dela saem como nulas
+CALENDAR_START = pd.Timestamp('2015-12-01')
+CALENDAR_END = pd.Timestamp('2040-11-30')
+
+
+@lru_cache(maxsize=1)
+def calendar_table():
+    """Uma linha por dia: ano, trimestre, mês e semana fiscais.
+
+    A semana conta de 1 a partir do primeiro dia do trimestre fiscal (a
+    mesma regra do nome dos arquivos da captura: LATAM_CQ_W11...).
+    """
+    dates = pd.date_range(CALENDAR_START, CALENDAR_END, freq='D')
+    months_in = np.asarray((dates.month - FISCAL_YEAR_START_MONTH) % 12)
+    fiscal_year = np.asarray(dates.year) + (np.asarray(dates.month) >= FISCAL_YEAR_START_MONTH)
+    quarter = months_in // 3 + 1
+    months = dates.to_period('M')
+    quarter_start = (months - months_in % 3).to_timestamp()
+    week = np.asarray((dates - quarter_start).days) // 7 + 1
+    return pd.DataFrame({
+        'Fiscal Year': fiscal_year.astype(np.int16),
+        'Fiscal Quarter Label': pd.Categorical([f'FY{y % 100:02d} Q{q}' for y, q in zip(fiscal_year, quarter)]),
+        'Fiscal Quarter Number': quarter.astype(np.int8),
+        'Fiscal Month': (months_in + 1).astype(np.int8),
+        'Fiscal Week': week.astype(np.int8),
+        'Fiscal Week Start': quarter_start + pd.to_timedelta((week - 1) * 7, unit='D'),
+        'Fiscal Month Start': months.to_timestamp(),
+    }, index=pd.Index(dates, name='Date'))
+
+
+def fiscal_attributes(dates, columns=None):
+    """Atributos fiscais de uma coluna de datas, por lookup vetorizado na tabela.
+
+    Datas nulas ou fora do calendário saem nulas; o índice é o de `dates`.
+    """
+    table = calendar_table()
+    if columns is not None:
+        table = table[list(columns)]
+    days = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    pos = ((days - CALENDAR_START).dt.days).to_numpy(dtype=float, na_value=np.nan)
+    valid = (pos >= 0) & (pos < len(table))
+    out = table.iloc[np.where(valid, pos, 0).astype(np.int64)].reset_index(drop=True)
+    out.index = days.index
+    if not valid.all():
+        out = out.astype({c: 'Int64' for c in out.columns if out[c].dtype.kind in 'iu'})
+        out[~valid] = None
+    return out
+
+
+def week_in_quarter(dt: datetime.date) -> int:
+    """Semana do trimestre fiscal de uma data (1 = primeira semana)."""
+    return int(calendar_table().at[pd.Timestamp(dt), 'Fiscal Week'])
@@ -0,0 +1,33 @@
+import math
+
+import pandas as pd
+
+# Tamanhos de página oferecidos no Raw Data
+PAGE_SIZES = [25, 50, 100, 200]
+
+
+def order_rows(index, sort_values=None, descending=False, filter_values=None, needle=''):
+    """Row ids do Raw Data depois do filtro de coluna e da ordenação.
+
+    `sort_values` / `filter_values` são a coluna inteira do snapshot (Series
+    compartilhada); só as linhas de `index` são lidas.
+    """
+    rows = pd.Index(index)
+    if filter_values is not None and needle:
+        vals = filter_values.reindex(rows)
+        mask = vals.astype(str).str.contains(needle, case=False, na=False, regex=False)
+        rows = rows[mask.to_numpy(dtype=bool)]
+    if sort_values is not None:
+        vals = sort_values.reindex(rows)
+        rows = vals.sort_values(ascending=not descending, na_position='last', kind='stable').index
+    return rows
+
+
+def page_count(total, page_size):
+    return max(1, math.ceil(total / page_size))
+
+
+def page_rows(rows, page, page_size):
+    """Fatia da página `page` (começando em 1)."""
+    start = (page - 1) * page_size
+    return rows[start:start + page_size]
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Página mock do Clari para testar a captura offline.
+
+Reproduz só o necessário para o Captura_reports_Clariok.py: página do
+relatório com o menu ⋮ > Export > CSV, painel de notificações que mostra o
+link quando o export "termina" (após --delay segundos) e o download do CSV.
+As notificações anteriores ficam no painel (a mais recente primeiro), cada
+export com um link próprio, como no Clari.
+
+    python mock_clari_export.py --port 8765 --delay 5
+    CLARI_BASE_URL=http://localhost:8765 python Captura_reports_Clariok.py
+"""
+
+import argparse
+import glob
+import html
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# id da URL -> (nome do relatório, prefixo do CSV em Data/ servido no download)
+REPORTS = {
+    "68154b1c2385aa673b611594": ("LATAM FY25 This Quarter all pipe", "LATAM_CQ_"),
+    "681a6248209b07709f9ccc6b": ("LATAM FY25 NQ all pipe",           "LATAM_NQ_"),
+    "681c333553fea2471096c4ba": ("Pipe LATAM FY25 full year",        "LATAM_full_year_"),
+}
+
+SAMPLE_CSV = (
+    "Opportunity,Account Name,Sales Team Member,Stage,Close Date,Total New ASV,Forecast Indicator\n"
+    "0061,Mock Account,Mock Owner,06 - Customer Commit,\"Jun 20, 2025\",\"$1,000.00\",Upside\n"
+)
+
+# Mesma estrutura de DOM que os XPaths absolutos do script esperam
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"/><title>Mock Clari — {title}</title></head>
+<body>
+<div id="root"><div><div><div>
+  <div></div>
+  <div><div><div><div><div></div><div><div><div>
+    <div></div><div></div><div></div>
+    <div><div><div><button id="actions">⋮</button></div></div></div>
+  </div></div></div></div></div></div></div>
+  <nav><div></div><div><div><button id="notifications">🔔</button></div></div></nav>
+</div></div></div></div>
+<div></div><div></div><div></div>
+<div id="portal"></div>
+<script>
+const REPORT = {report};
+const portal = document.getElementById('portal');
+document.getElementById('actions').onclick = () => {{
+  portal.innerHTML = '<div>' + '<button><div></div><div><div>Item</div></div></button>'.repeat(4)
+    + '<button><div></div><div><div id="export-csv">Export CSV</div></div></button></div>';
+  document.getElementById('export-csv').onclick = () => {{
+    fetch('/export?report=' + encodeURIComponent(REPORT), {{method: 'POST'}});
+    portal.innerHTML = '';
+  }};
+}};
+document.getElementById('notifications').onclick = async () => {{
+  const items = await (await fetch('/notifications')).json();
+  portal.innerHTML = '<div role="dialog"><div><div></div><div>' + items.map(n =>
+    '<article><div></div><div>' + n.report + '</div><div>'
+    + (n.href ? '<a href="' + n.href + '">Download</a>' : 'Preparing export…')
+    + '</div></article>').join('') + '</div></div></div>';
+}};
+document.addEventListener('keydown', e => {{ if (e.key === 'Escape') portal.innerHTML = ''; }});
+</script>
+</body></html>
+"""
+
+
+class MockClari:
+    def __init__(self, delay, data_dir):
+        self.delay = delay
+        self.data_dir = data_dir
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def export(self, report):
+        # O full year é o maior export: demora 3x mais
+        delay = self.delay * (3 if 'full year' in report else 1)
+        with self.lock:
+            self.jobs.append((report, time.time() + delay))
+
+    def notifications(self):
+        now = time.time()
+        with self.lock:
+            jobs = list(enumerate(self.jobs))
+        ids = {name: rid for rid, (name, _) in REPORTS.items()}
+        return [
+            {'report': name, 'href': f'/files/{ids[name]}/{job}.csv' if ready <= now else None}
+            for job, (name, ready) in reversed(jobs)
+        ]
+
+    def csv_bytes(self, report_id):
+        _, prefix = REPORTS[report_id]
+        files = sorted(glob.glob(os.path.join(self.data_dir, f'{prefix}*.csv')), key=os.path.getmtime)
+        if files:
+            with open(files[-1], 'rb') as f:
+                return f.read()
+        return SAMPLE_CSV.encode('utf-8')
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, body, ctype, status=200, headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/login':
+                self._send('<html><body><div>Mock Clari: já autenticado.</div></body></html>'.encode(), 'text/html')
+            elif path.startswith('/opportunities/') and path.rsplit('/', 1)[-1] in REPORTS:
+                name, _ = REPORTS[path.rsplit('/', 1)[-1]]
+                page = PAGE.format(title=html.escape(name), report=json.dumps(name))
+                self._send(page.encode('utf-8'), 'text/html; charset=utf-8')
+            elif path == '/notifications':
+                self._send(json.dumps(mock.notifications()).encode(), 'application/json')
+            elif path.startswith('/files/') and path.split('/')[2] in REPORTS:
+                report_id = path.split('/')[2]
+                job = os.path.splitext(path.rsplit('/', 1)[-1])[0]
+                self._send(mock.csv_bytes(report_id), 'text/csv', headers={
+                    'Content-Disposition': f'attachment; filename="export_{report_id}_{job}.csv"',
+                })
+            else:
+                self._send(b'not found', 'text/plain', status=404)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            report = parse_qs(url.query).get('report', [''])[0]
+            if url.path == '/export' and report in {name for name, _ in REPORTS.values()}:
+                mock.export(report)
+                self._send(b'{}', 'application/json')
+            else:
+                self._send(b'not found', 'text/plain', status=404)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=5, help='segundos até o export ficar pronto')
+    parser.add_argument('--data', default=os.path.join(BASE_DIR, 'Data'), help='pasta com CSVs de exemplo')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(MockClari(args.delay, args.data)))
+    print(f"Mock Clari em http://127.0.0.1:{args.port} (export em {args.delay:g}s)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+from snapshot_store import CAPTURED_AT, KEY, SNAPSHOT
+
+MEASURE = 'Total New ASV'
+
+# Campos comparados entre duas capturas (o fingerprint da linha cobre todos)
+DIFF_COLUMNS = ['Stage', 'Close Date', MEASURE, 'Forecast Indicator', 'Sales Team Member', 'Opportunity']
+
+WON_STAGES = ['Closed - Booked']
+LOST_STAGES = ['Closed - Lost', 'Closed - Clean Up']
+
+# Barras do waterfall, na ordem: do pipeline aberto inicial ao final
+MOVEMENTS = ['New', 'Reopened', 'ASV Up', 'ASV Down', 'Won', 'Lost', 'Removed']
+# Mudanças que não movem o pipeline aberto (Delta sempre 0): deal fechado
+# que continuou fechado, e deal aberto que mudou sem mudar o ASV
+CHANGED_AFTER_CLOSE = 'Changed after close'
+UNCHANGED_ASV = 'Unchanged ASV'
+STILL_MOVEMENTS = [CHANGED_AFTER_CLOSE, UNCHANGED_ASV]
+
+
+def row_fingerprints(df, columns=DIFF_COLUMNS):
+    """Hash de 64 bits por linha sobre `columns`, indexado pela chave."""
+    cols = [c for c in columns if c in df.columns]
+    frame = df[cols].astype({c: object for c in cols if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    return pd.Series(pd.util.hash_pandas_object(frame, index=False).to_numpy(), index=df.index)
+
+
+def _open_asv(df):
+    closed = df['Stage'].isin(WON_STAGES + LOST_STAGES).to_numpy()
+    return np.where(closed, 0.0, np.nan_to_num(df[MEASURE].to_numpy(dtype=float)))
+
+
+def diff_snapshots(old, new, key=KEY, old_fp=None, new_fp=None):
+    """Movimento entre duas capturas, uma linha por oportunidade que mudou.
+
+    As linhas se casam por `key`; só as que têm fingerprint diferente são
+    comparadas campo a campo. `Delta` é a variação do pipeline aberto
+    atribuída ao `Movement` da linha, então a soma dos deltas fecha
+    exatamente a diferença entre o pipeline aberto final e o inicial.
+    """
+    old = old.set_index(key)
+    new = new.set_index(key)
+    old_fp = row_fingerprints(old) if old_fp is None else old_fp
+    new_fp = row_fingerprints(new) if new_fp is None else new_fp
+
+    common = old.index.intersection(new.index)
+    changed = common[old_fp.reindex(common).to_numpy() != new_fp.reindex(common).to_numpy()]
+    added = new.index.difference(old.index)
+    removed = old.index.difference(new.index)
+
+    ids = changed.append(added).append(removed)
+    cols = [c for c in DIFF_COLUMNS if c in old.columns and c in new.columns]
+    before = old.reindex(ids)[cols]
+    after = new.reindex(ids)[cols]
+    in_old = ids.isin(old.index)
+    in_new = ids.isin(new.index)
+    open_before = np.where(in_old, _open_asv(before), 0.0)
+    open_after = np.where(in_new, _open_asv(after), 0.0)
+    was_open = in_old & ~before['Stage'].isin(WON_STAGES + LOST_STAGES).to_numpy()
+    is_open = in_new & ~after['Stage'].isin(WON_STAGES + LOST_STAGES).to_numpy()
+    delta = open_after - open_before
+
+    movement = np.select(
+        [
+            ~in_old,
+            ~in_new,
+            was_open & after['Stage'].isin(WON_STAGES).to_numpy(),
+            was_open & after['Stage'].isin(LOST_STAGES).to_numpy(),
+            ~was_open & is_open,
+            was_open & is_open & (delta > 0),
+            was_open & is_open & (delta < 0),
+            ~was_open & ~is_open,
+        ],
+        ['New', 'Removed', 'Won', 'Lost', 'Reopened', 'ASV Up', 'ASV Down', CHANGED_AFTER_CLOSE],
+        default=UNCHANGED_ASV,
+    )
+    slipped = (in_old & in_new & (after['Close Date'] > before['Close Date']).to_numpy()) \
+        if 'Close Date' in cols else np.zeros(len(ids), dtype=bool)
+    stage_changed = in_old & in_new & (before['Stage'].astype(object) != after['Stage'].astype(object)).to_numpy()
+
+    out = pd.DataFrame({
+        key: ids,
+        'Opportunity': after['Opportunity'].fillna(before['Opportunity']).to_numpy() if 'Opportunity' in cols else '',
+        'Movement': movement,
+        'Delta': delta,
+        'Stage Before': before['Stage'].to_numpy(),
+        'Stage After': after['Stage'].to_numpy(),
+        'Close Date Before': before['Close Date'].to_numpy() if 'Close Date' in cols else pd.NaT,
+        'Close Date After': after['Close Date'].to_numpy() if 'Close Date' in cols else pd.NaT,
+        'ASV Before': before[MEASURE].to_numpy(),
+        'ASV After': after[MEASURE].to_numpy(),
+        'Slipped': slipped,
+        'Stage Changed': stage_changed,
+    })
+    return out
+
+
+def open_pipeline(df):
+    return float(_open_asv(df).sum())
+
+
+def waterfall(old, new, changes):
+    """Barras do waterfall: pipeline aberto inicial, movimentos e final.
+
+    Um movimento fora de MOVEMENTS só ganha barra se mover o pipeline, para
+    que as barras sempre fechem de Start a End.
+    """
+    by_movement = changes.groupby('Movement')['Delta'].sum()
+    steps = [('Start', open_pipeline(old))]
+    steps += [(m, float(by_movement.get(m, 0.0))) for m in MOVEMENTS]
+    steps += [(m, float(d)) for m, d in by_movement.items() if m not in MOVEMENTS and d != 0]
+    steps.append(('End', open_pipeline(new)))
+    return pd.DataFrame(steps, columns=['Step', MEASURE])
+
+
+def summarize(changes):
+    """Contagem e ASV por movimento, mais datas adiadas e mudanças de fase."""
+    summary = changes.groupby('Movement').agg(Deals=(KEY, 'size'), Delta=('Delta', 'sum'))
+    summary = summary.reindex(MOVEMENTS + STILL_MOVEMENTS, fill_value=0)
+    extra = pd.DataFrame({
+        'Deals': [int(changes['Slipped'].sum()), int(changes['Stage Changed'].sum())],
+        'Delta': [0.0, 0.0],
+    }, index=['Slipped', 'Stage Change'])
+    return pd.concat([summary, extra])
+
+
+def diff_series(history):
+    """Diff de cada par consecutivo de capturas do histórico (um relatório).
+
+    `history` é a tabela do SnapshotStore (já filtrada); o fingerprint de
+    cada captura é calculado uma única vez e reaproveitado nos dois pares
+    de que ela participa.
+    """
+    order = (history[[SNAPSHOT, CAPTURED_AT]].drop_duplicates(SNAPSHOT)
+             .sort_values(CAPTURED_AT)[SNAPSHOT].astype(str).tolist())
+    frames = {s: g for s, g in history.groupby(history[SNAPSHOT].astype(str), sort=False)}
+    prints = {s: row_fingerprints(frames[s].set_index(KEY)) for s in order}
+    rows = []
+    for prev, cur in zip(order, order[1:]):
+        changes = diff_snapshots(frames[prev], frames[cur], old_fp=prints[prev], new_fp=prints[cur])
+        steps = waterfall(frames[prev], frames[cur], changes).set_index('Step')[MEASURE]
+        rows.append({'From': prev, 'To': cur, **steps.to_dict()})
+    return pd.DataFrame(rows)
@@ -0,0 +1,153 @@
+import os
+import re
+import datetime
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from clari_data import PARQUET_COMPRESSION, load_snapshot, snapshot_sources
+from clari_schema import resolve_column
+
+log = logging.getLogger(__name__)
+
+# Chave de cada linha no histórico: Opportunity ID + snapshot
+KEY = 'Opportunity ID'
+SNAPSHOT = 'Snapshot'
+REPORT = 'Report'
+FISCAL_WEEK = 'Fiscal Week'
+CAPTURED_AT = 'Captured At'
+
+# Colunas guardadas por snapshot (as que as perguntas semana a semana usam)
+HISTORY_COLUMNS = [
+    'Opportunity', 'Account Name', 'Sales Team Member', 'Stage', 'Close Date',
+    'Total New ASV', 'Forecast Indicator', 'Fiscal Quarter', 'Region',
+]
+
+# LATAM_CQ_W11_20250516_1916 -> relatório LATAM_CQ, semana 11, 2025-05-16 19:16
+_NAME = re.compile(r'^(?P<report>.+?)_W(?P<week>\d+)_(?P<stamp>\d{8}_\d{4})$')
+# Nomes antigos sem semana (LATAM_full_year_202516_1916)
+_LEGACY_NAME = re.compile(r'^(?P<report>.+?)_\d+_\d{4}$')
+
+
+def parse_snapshot_name(path):
+    """(relatório, semana fiscal, data da captura) a partir do nome do arquivo.
+
+    Sem semana no nome, a semana fica None e a data vem do mtime do arquivo.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    m = _NAME.match(stem)
+    if m:
+        captured = datetime.datetime.strptime(m.group('stamp'), '%Y%m%d_%H%M')
+        return m.group('report'), int(m.group('week')), captured
+    m = _LEGACY_NAME.match(stem)
+    report = m.group('report') if m else stem
+    return report, None, datetime.datetime.fromtimestamp(os.path.getmtime(path)).replace(microsecond=0)
+
+
+class SnapshotStore:
+    """Histórico de todas as capturas numa tabela colunar só de acréscimos.
+
+    Cada snapshot vira um arquivo Parquet em `root/<relatório>/<snapshot>.parquet`
+    (nunca reescrito); as leituras tratam a pasta inteira como uma tabela,
+    com filtros empurrados para o Parquet.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _part(self, report, snapshot):
+        return os.path.join(self.root, report, f'{snapshot}.parquet')
+
+    def append(self, source):
+        """Acrescenta o snapshot `source` (CSV ou Parquet); ignora se já existe."""
+        snapshot = os.path.splitext(os.path.basename(source))[0]
+        report, week, captured = parse_snapshot_name(source)
+        part = self._part(report, snapshot)
+        if os.path.exists(part):
+            return part
+
+        df = load_snapshot(source)
+        key = resolve_column(df, KEY)
+        if key is None:
+            log.warning("Snapshot sem %s, fora do histórico: %s", KEY, source)
+            return None
+        cols = [c for c in HISTORY_COLUMNS if c in df.columns and c != key]
+        rows = len(df)
+        frame = pd.DataFrame({
+            KEY: df[key].astype(str).to_numpy(),
+            SNAPSHOT: pd.Categorical([snapshot] * rows),
+            REPORT: pd.Categorical([report] * rows),
+            FISCAL_WEEK: pd.array([week] * rows, dtype='Int16'),
+            CAPTURED_AT: pd.Series([captured] * rows, dtype='datetime64[ns]').to_numpy(),
+        })
+        # Categóricas viram texto: cada arquivo tem categorias próprias
+        for c in cols:
+            s = df[c]
+            frame[c] = (s.astype(object) if isinstance(s.dtype, pd.CategoricalDtype) else s).to_numpy()
+
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        tmp = f"{part}.{os.getpid()}.tmp"
+        try:
+            pq.write_table(table, tmp, compression=PARQUET_COMPRESSION)
+            os.replace(tmp, part)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return part
+
+    def sync(self, folder):
+        """Acrescenta todos os snapshots de `folder` que ainda não estão no histórico."""
+        return [p for p in (self.append(os.path.join(folder, f)) for f in snapshot_sources(folder)) if p]
+
+    def _dataset(self):
+        if not os.path.isdir(self.root):
+            return None
+        return ds.dataset(self.root, format='parquet', exclude_invalid_files=True)
+
+    def table(self, report=None, snapshots=None, columns=None):
+        """Linhas do histórico, filtradas por relatório e/ou snapshots."""
+        dataset = self._dataset()
+        if dataset is None:
+            return pd.DataFrame(columns=[KEY, SNAPSHOT, REPORT, FISCAL_WEEK, CAPTURED_AT])
+        expr = None
+        if report is not None:
+            expr = ds.field(REPORT) == report
+        if snapshots is not None:
+            cond = ds.field(SNAPSHOT).isin(list(snapshots))
+            expr = cond if expr is None else expr & cond
+        if columns is not None:
+            columns = [c for c in [KEY, SNAPSHOT, REPORT, FISCAL_WEEK, CAPTURED_AT] + list(columns)
+                       if c in dataset.schema.names]
+            columns = list(dict.fromkeys(columns))
+        return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+    def catalog(self):
+        """Um registro por snapshot: relatório, semana fiscal, captura e linhas."""
+        meta = self.table(columns=[])
+        if meta.empty:
+            return meta.assign(Rows=pd.Series(dtype='int64'))
+        return (
+            meta.groupby([REPORT, SNAPSHOT, FISCAL_WEEK, CAPTURED_AT], observed=True, dropna=False)
+                .size().rename('Rows').reset_index()
+                .sort_values([REPORT, CAPTURED_AT], ignore_index=True)
+        )
+
+    def weekly(self, report):
+        """Último snapshot de cada semana fiscal do relatório, em ordem."""
+        cat = self.catalog()
+        cat = cat[cat[REPORT] == report].sort_values(CAPTURED_AT)
+        return cat.groupby(FISCAL_WEEK, dropna=False, sort=True).tail(1).sort_values(CAPTURED_AT, ignore_index=True)
+
+    def week_over_week(self, report, by='Stage', measure='Total New ASV'):
+        """Soma de `measure` por `by` (linhas) e semana fiscal (colunas).
+
+        Uma consulta só sobre o histórico, sem reabrir os CSVs de cada semana.
+        """
+        weeks = self.weekly(report)
+        rows = self.table(report=report, snapshots=weeks[SNAPSHOT].tolist(), columns=[by, measure])
+        return rows.pivot_table(index=by, columns=FISCAL_WEEK, values=measure,
+                                aggfunc='sum', fill_value=0, observed=True, dropna=False)
@@ -0,0 +1,169 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from committed_store import DEAL_ID, SYNTHETIC_ID_PREFIX, CommittedDealsStore, with_deal_ids
+
+
+def deals(*rows):
+    return pd.DataFrame(
+        [{DEAL_ID: d, 'Opportunity': f'Opp {d}', 'Total New ASV': asv} for d, asv in rows],
+        columns=[DEAL_ID, 'Opportunity', 'Total New ASV'],
+    )
+
+
+def ids(frame):
+    return frame[DEAL_ID].astype(str).tolist()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CommittedDealsStore(str(tmp_path / 'committed.sqlite'))
+
+
+def test_apply_edit_records_only_the_difference(store):
+    before = deals(('A', 1.0), ('B', 2.0), ('C', 3.0))
+    store.upsert('ana', 'CQ', before)
+
+    after = deals(('A', 1.0), ('C', 30.0), ('D', 4.0))
+    assert store.apply_edit('ana', 'CQ', before, after) == (2, 1)
+
+    loaded = store.load('ana', 'CQ')
+    assert ids(loaded) == ['A', 'C', 'D']
+    assert loaded.set_index(DEAL_ID)['Total New ASV'].to_dict() == {'A': 1.0, 'C': 30.0, 'D': 4.0}
+    ops = store.history('ana', 'CQ', limit=None)['op'].tolist()
+    assert sorted(ops[:3]) == ['add', 'edit', 'remove']
+
+
+def test_apply_edit_is_one_transaction(store, monkeypatch):
+    before = deals(('A', 1.0), ('B', 2.0))
+    store.upsert('ana', 'CQ', before)
+    after = deals(('A', 10.0))
+
+    def boom(*args):
+        raise RuntimeError('falha no meio da gravação')
+
+    monkeypatch.setattr('committed_store._now', boom)
+    with pytest.raises(RuntimeError):
+        store.apply_edit('ana', 'CQ', before, after)
+    # Nem a remoção de B nem a edição de A ficaram gravadas
+    assert ids(store.load('ana', 'CQ')) == ['A', 'B']
+    assert len(store.history('ana', 'CQ', limit=None)) == 2
+
+
+def test_undo_walks_back_one_event_at_a_time(store):
+    store.upsert('ana', 'CQ', deals(('A', 1.0)))
+    store.upsert('ana', 'CQ', deals(('A', 5.0)))
+    store.delete('ana', 'CQ', ['A'])
+
+    assert store.undo('ana', 'CQ')['op'] == 'remove'
+    assert store.load('ana', 'CQ')['Total New ASV'].tolist() == [5.0]
+    assert store.undo('ana', 'CQ')['op'] == 'edit'
+    assert store.load('ana', 'CQ')['Total New ASV'].tolist() == [1.0]
+    assert store.undo('ana', 'CQ')['op'] == 'add'
+    assert store.load('ana', 'CQ').empty
+    assert store.undo('ana', 'CQ') is None
+
+
+def test_undo_remove_restores_original_position(store):
+    store.upsert('ana', 'CQ', deals(('A', 1.0), ('B', 2.0), ('C', 3.0)))
+    store.delete('ana', 'CQ', ['B'])
+    assert ids(store.load('ana', 'CQ')) == ['A', 'C']
+
+    store.undo('ana', 'CQ')
+    assert ids(store.load('ana', 'CQ')) == ['A', 'B', 'C']
+
+
+def test_undo_remove_after_compaction_restores_position(store):
+    store.upsert('ana', 'CQ', deals(('A', 1.0), ('B', 2.0), ('C', 3.0)))
+    store.compact('ana', 'CQ')
+    store.delete('ana', 'CQ', ['A'])
+    store.compact('ana', 'CQ')
+
+    store.undo('ana', 'CQ')
+    assert ids(store.load('ana', 'CQ')) == ['A', 'B', 'C']
+    store.compact('ana', 'CQ')
+    assert ids(store.load('ana', 'CQ')) == ['A', 'B', 'C']
+
+
+def test_compact_keeps_state_and_journal(store):
+    store.upsert('ana', 'CQ', deals(('A', 1.0), ('B', 2.0)))
+    store.apply_edit('ana', 'CQ', deals(('A', 1.0), ('B', 2.0)), deals(('B', 20.0), ('C', 3.0)))
+    expected = store.load('ana', 'CQ')
+
+    assert store.compact('ana', 'CQ') == 5
+    assert store.compact('ana', 'CQ') == 0
+    pd.testing.assert_frame_equal(store.load('ana', 'CQ'), expected)
+    assert len(store.history('ana', 'CQ', limit=None)) == 5
+    # O desfazer continua funcionando sobre eventos já compactados
+    for _ in range(3):
+        store.undo('ana', 'CQ')
+    pd.testing.assert_frame_equal(store.load('ana', 'CQ'), deals(('A', 1.0), ('B', 2.0)))
+
+
+def test_compaction_runs_automatically(tmp_path):
+    store = CommittedDealsStore(str(tmp_path / 'committed.sqlite'), compact_every=3)
+    store.upsert('ana', 'CQ', deals(('A', 1.0), ('B', 2.0), ('C', 3.0)))
+    store.upsert('ana', 'CQ', deals(('D', 4.0)))
+    assert ids(store.load('ana', 'CQ')) == ['A', 'B', 'C', 'D']
+
+
+def test_users_and_csv_types_are_isolated(store):
+    store.upsert('ana', 'CQ', deals(('A', 1.0)))
+    store.upsert('ana', 'NQ', deals(('B', 2.0)))
+    store.upsert('bia', 'CQ', deals(('C', 3.0)))
+    store.undo('ana', 'CQ')
+
+    assert store.load('ana', 'CQ').empty
+    assert ids(store.load('ana', 'NQ')) == ['B']
+    assert ids(store.load('bia', 'CQ')) == ['C']
+
+
+def test_history_is_limited_to_latest_events(store):
+    for i in range(5):
+        store.upsert('ana', 'CQ', deals(('A', float(i))))
+    history = store.history('ana', 'CQ', limit=2)
+    assert len(history) == 2
+    assert history['id'].tolist() == sorted(history['id'], reverse=True)
+
+
+def test_migrate_csv_runs_once(store, tmp_path):
+    csv_path = tmp_path / 'committed_deals_CQ.csv'
+    deals(('A', 1.0), ('B', 2.0)).to_csv(csv_path, index=False)
+
+    assert store.migrate_csv('ana', 'CQ', str(csv_path))
+    assert not store.migrate_csv('ana', 'CQ', str(csv_path))
+    assert ids(store.load('ana', 'CQ')) == ['A', 'B']
+
+
+def test_migrate_csv_check_does_not_take_the_write_lock(store, tmp_path, monkeypatch):
+    csv_path = tmp_path / 'committed_deals_CQ.csv'
+    deals(('A', 1.0)).to_csv(csv_path, index=False)
+    store.migrate_csv('ana', 'CQ', str(csv_path))
+
+    # Outra sessão segurando a escrita: a verificação não pode esperar por ela
+    monkeypatch.setattr('committed_store.BUSY_TIMEOUT', 0.1)
+    other = sqlite3.connect(store.path)
+    other.execute('BEGIN IMMEDIATE')
+    try:
+        assert not store.migrate_csv('ana', 'CQ', str(csv_path))
+        assert not store.migrate_csv('ana', 'NQ', str(tmp_path / 'missing.csv'))
+    finally:
+        other.rollback()
+        other.close()
+    assert store.load('ana', 'NQ').empty
+
+
+def test_rows_without_deal_id_get_a_stable_synthetic_key(store):
+    frame = deals(('A', 1.0), (None, 2.0))
+    keyed = with_deal_ids(frame)
+    assert keyed[DEAL_ID].iloc[1].startswith(SYNTHETIC_ID_PREFIX)
+    assert with_deal_ids(frame).equals(keyed)
+
+    store.upsert('ana', 'CQ', frame)
+    assert ids(store.load('ana', 'CQ')) == ids(keyed)
+    # A linha editada pela chave gerada continua sendo a mesma linha
+    edited = keyed.assign(**{'Total New ASV': [1.0, 20.0]})
+    store.apply_edit('ana', 'CQ', keyed, edited)
+    assert store.load('ana', 'CQ')['Total New ASV'].tolist() == [1.0, 20.0]